@@ -3,7 +3,10 @@ import logging
 from .api import *
 from .client import *
 from .decrypt import *
+from .download import *
 from .errors import *
+from .keystore import *
 from .models import *
+from .store import *
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
@@ -3,3 +3,4 @@ from .catalog import *
 from .library import *
 from .playback import *
 from .playlist import *
+from .transfer import *
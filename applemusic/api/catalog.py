@@ -130,6 +130,31 @@ class CatalogAPI:
                     return Playlist(self.client, **js["data"][0])
             return None
 
+    def album_tracks(self, album: Album, lang="en") -> list[Song]:
+        """List[`Song`]: Returns songs of album in album order.
+
+        Music videos are skipped.
+
+        Arguments
+        ---------
+        album: `Album`
+            Catalog album to get songs of.
+        """
+        songs = []
+        url = f"/v1/catalog/{self.client.storefront}/albums/{album.id}/tracks"
+        params = {"limit": 300, "l": lang}
+        while url:
+            with self.client.session.get(
+                self.client.session.base_url + url, params=params
+            ) as resp:
+                js = resp.json()
+                _log.debug("album tracks response: %s", js)
+                for track in js["data"]:
+                    if track["type"] == CatalogTypes.Songs.value:
+                        songs.append(Song(self.client, **track))
+                url = js.get("next")
+        return songs
+
     def get_by_isrc(self, isrc: str) -> Song | None:
         """`Song`: Returns a song by it's ISRC.
 
@@ -161,13 +186,13 @@ class CatalogAPI:
             return None
         return self.get_by_id(catalog_id, CatalogTypes.Songs)
 
-    def get_artwork(self, song: Song) -> bytes:
+    def get_artwork(self, song: Song | Album) -> bytes:
         """`bytes`: Returns artwork for song.
 
         Arguments
         ---------
-        song: `Song`
-            Song to get artwork for.
+        song: `Song`|`Album`
+            Song or album to get artwork for.
         """
         url = song.artwork.url
         if url == "":
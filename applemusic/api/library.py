@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterator
 
 from applemusic.models.album import Album, LibraryAlbum
 from applemusic.models.artist import Artist, LibraryArtist
@@ -10,6 +11,7 @@ from applemusic.models.meta import CatalogTypes, LibraryTypes
 from applemusic.models.object import AppleMusicObject
 from applemusic.models.playlist import LibraryPlaylist, Playlist
 from applemusic.models.song import LibrarySong, Song
+from applemusic.utils import chunked
 
 if TYPE_CHECKING:
     from applemusic.client import ApiClient
@@ -31,33 +33,70 @@ class LibraryAPI:
         self.client = client
 
     def songs(
-        self, sort: SortOrder = SortOrder.DateAddedDescending, lang="en"
+        self,
+        sort: SortOrder = SortOrder.DateAddedDescending,
+        lang="en",
+        include_catalog: bool = False,
     ) -> list[LibrarySong]:
         """List[`Song`]: Returns a list of library songs.
 
         Could be slow. Internally limited by 100 songs per request.
 
         Needs a Music User Token.
+
+        Arguments
+        ---------
+        sort: `SortOrder`
+            Order of returned songs.
+        include_catalog: `bool`
+            Request corresponding catalog songs in the same responses.
+        """
+        return list(self.iter_songs(sort, lang, include_catalog))
+
+    def iter_songs(
+        self,
+        sort: SortOrder = SortOrder.DateAddedDescending,
+        lang="en",
+        include_catalog: bool = False,
+    ) -> Iterator[LibrarySong]:
+        """Iterator[`LibrarySong`]: Yields library songs page by page.
+
+        Internally limited by 100 songs per request.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        sort: `SortOrder`
+            Order of returned songs.
+        include_catalog: `bool`
+            Request corresponding catalog songs in the same responses.
         """
-        songs = []
         url = "/v1/me/library/songs"
+        params = {"limit": 100, "sort": sort.value, "l": lang}
+        if include_catalog:
+            params["include"] = "catalog"
         while True:
             with self.client.session.get(
                 self.client.session.base_url + url,
-                params={"limit": 100, "sort": sort.value, "l": lang},
+                params=params,
             ) as resp:
                 js = resp.json()
                 _log.debug("songs list response: %s", js)
                 for s in js["data"]:
-                    song = LibrarySong(self.client, **s)
-                    songs.append(song)
+                    yield LibrarySong(self.client, **s)
                 if url := js.get("next", False):
                     pass
                 else:
-                    return songs
+                    return
 
     def search(
-        self, query: str, return_type: LibraryTypes, limit: int = 5, lang="en"
+        self,
+        query: str,
+        return_type: LibraryTypes,
+        limit: int = 5,
+        lang="en",
+        include_catalog: bool = False,
     ) -> list[LibrarySong | LibraryAlbum | LibraryArtist | LibraryPlaylist]:
         """List[`LibrarySong`|`LibraryAlbum`|`LibraryArtist`|`LibraryPlaylist`]: Returns search results.
         Returned type is determined by `return_type` parameter.
@@ -72,14 +111,19 @@ class LibraryAPI:
             What to search for.
         limit: `int`
             Limit for returned results. Can't be more than 25 internally.
+        include_catalog: `bool`
+            Request corresponding catalog songs in the same responses.
         """
         types = [return_type.value]
         results = []
         url = "/v1/me/library/search"
+        params = {"term": query, "types": types, "limit": 25, "l": lang}
+        if include_catalog:
+            params["include"] = "catalog"
         while True:
             with self.client.session.get(
                 self.client.session.base_url + url,
-                params={"term": query, "types": types, "limit": 25, "l": lang},
+                params=params,
             ) as resp:
                 js = resp.json()
                 _log.debug("search response: %s", js)
@@ -138,6 +182,41 @@ class LibraryAPI:
                 _log.debug("library add response: %s", resp.json())
             return resp.status_code == 202
 
+    def add_by_ids(
+        self,
+        object_ids: list[str],
+        object_type: CatalogTypes,
+        chunk_size: int = 100,
+    ) -> bool:
+        """`bool`: Adds catalog objects to user's music library by their ids.
+
+        IDs are sent in chunks of `chunk_size`, chunks are sent concurrently.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        object_ids: List[`str`]
+            Catalog IDs to add.
+        object_type: `CatalogTypes`
+            Type of added objects. Can be either songs, albums, artists or playlists.
+        chunk_size: `int`
+            Amount of IDs per request.
+        """
+
+        def add(ids: list[str]) -> bool:
+            with self.client.session.post(
+                self.client.session.base_url + "/v1/me/library",
+                params={f"ids[{object_type.value}]": ",".join(ids)},
+            ) as resp:
+                if resp.text != "":
+                    _log.debug("library add response: %s", resp.json())
+                return resp.status_code == 202
+
+        with ThreadPoolExecutor(self.client.max_workers) as executor:
+            results = list(executor.map(add, chunked(object_ids, chunk_size)))
+        return all(results)
+
     def remove(self, object_to_delete: AppleMusicObject) -> bool:
         """`bool`: Removes an object from user's music library.
 
@@ -278,6 +357,66 @@ class LibraryAPI:
                     return LibraryPlaylist(self.client, **js["data"][0])
             return None
 
+    def get_by_ids(
+        self,
+        object_ids: list[str],
+        object_type: LibraryTypes,
+        lang="en",
+        chunk_size: int = 100,
+    ) -> list[LibrarySong | LibraryAlbum | LibraryArtist | LibraryPlaylist]:
+        """List[`LibrarySong`|`LibraryAlbum`|`LibraryArtist`|`LibraryPlaylist`]: Returns library objects by their ids.
+
+        IDs are requested in chunks of `chunk_size`, chunks are fetched concurrently.
+        Unknown IDs are skipped, order of the found objects is preserved.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        object_ids: List[`str`]
+            Library IDs to search for.
+        object_type: `LibraryTypes`
+            Type of requested objects.
+        chunk_size: `int`
+            Amount of IDs per request.
+        """
+        url = f"/v1/me/library"
+        match object_type:
+            case LibraryTypes.Songs:
+                url += "/songs"
+            case LibraryTypes.Albums:
+                url += "/albums"
+            case LibraryTypes.Artists:
+                url += "/artists"
+            case LibraryTypes.Playlists:
+                url += "/playlists"
+
+        def fetch(ids: list[str]) -> list[dict]:
+            with self.client.session.get(
+                self.client.session.base_url + url,
+                params={"ids": ",".join(ids), "l": lang},
+            ) as resp:
+                js = resp.json()
+                _log.debug("get by ids response: %s", js)
+                return js.get("data", [])
+
+        results: list[
+            LibrarySong | LibraryAlbum | LibraryArtist | LibraryPlaylist
+        ] = []
+        with ThreadPoolExecutor(self.client.max_workers) as executor:
+            for data in executor.map(fetch, chunked(object_ids, chunk_size)):
+                for obj in data:
+                    match object_type:
+                        case LibraryTypes.Songs:
+                            results.append(LibrarySong(self.client, **obj))
+                        case LibraryTypes.Albums:
+                            results.append(LibraryAlbum(self.client, **obj))
+                        case LibraryTypes.Artists:
+                            results.append(LibraryArtist(self.client, **obj))
+                        case LibraryTypes.Playlists:
+                            results.append(LibraryPlaylist(self.client, **obj))
+        return results
+
     def get_artwork(self, song: LibrarySong) -> bytes:
         """`bytes`: Returns artwork for song.
 
@@ -290,4 +429,4 @@ class LibraryAPI:
         if url == "":
             return b""
         with self.client.session.get(url) as resp:
-            return resp.content
\ No newline at end of file
+            return resp.content
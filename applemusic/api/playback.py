@@ -1,17 +1,41 @@
 from __future__ import annotations
 
 import base64
+import contextlib
 import io
+import itertools
+import json
 import logging
-from typing import TYPE_CHECKING
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from enum import Enum
+from typing import TYPE_CHECKING, BinaryIO, Iterator
+from urllib.parse import parse_qsl, urljoin, urlsplit
 
 import m3u8
+import requests
+from mutagen import PaddingInfo
 from mutagen.mp4 import MP4, MP4Cover
+from pydantic import BaseModel
 from pywidevine import PSSH, Cdm, Device
 from pywidevine.license_protocol_pb2 import WidevinePsshData
 
 from applemusic.decrypt import decrypt
+from applemusic.errors import AppleMusicAPIException
+from applemusic.keystore import FileKeyStore, KeyStore
+from applemusic.models.album import Album
+from applemusic.models.lyrics import Lyrics
+from applemusic.models.meta import AudioVariants
 from applemusic.models.song import Song
+from applemusic.store import clone_file
+from applemusic.utils import safe_filename
 
 if TYPE_CHECKING:
     from applemusic.client import ApiClient
@@ -19,6 +43,39 @@ if TYPE_CHECKING:
 _log = logging.getLogger(__name__)
 
 
+class FlavorPolicy(Enum):
+    """Stream flavor selection policies."""
+
+    Best = "best"
+    BestLossless = "best-lossless"
+    SmallestAAC = "smallest-aac"
+    MaxBitrate = "max-bitrate"
+
+
+class TrackTags(BaseModel):
+    """Tag inputs that need network requests.
+
+    Fields left `None` are fetched by `PlaybackAPI.fetch_tags`.
+
+    Attributes
+    ----------
+    album: `Album`|`None`
+        Album containing the song.
+    lyrics: `Lyrics`|`None`
+        Lyrics of the song.
+    artwork: `bytes`|`None`
+        Cover art image.
+    fetched: `bool`
+        Set by `PlaybackAPI.fetch_tags`. Fields still `None` are absent for
+        the song and are not requested again.
+    """
+
+    album: Album | None = None
+    lyrics: Lyrics | None = None
+    artwork: bytes | None = None
+    fetched: bool = False
+
+
 class PlaybackAPI:
     """Playlist related API endpoints.
     WARNING: More hacky than other parts of the API! Can break at any time.
@@ -32,22 +89,121 @@ class PlaybackAPI:
         )
         self.license_url = "https://play.itunes.apple.com/WebObjects/MZPlay.woa/wa/acquireWebPlaybackLicense"
         self.default_flavor = "28:ctrp256"
+        # Flavor selection, default_flavor is used if policy is None
+        self.flavor_policy: FlavorPolicy | None = None
+        # Upper bitrate limit in kbps for FlavorPolicy.MaxBitrate
+        self.max_bitrate: int | None = None
+        # Threads decrypting fragments in parallel, 0 decrypts serially
+        self.decrypt_workers = 0
+        self.key_store = self.client.key_store
+        self.download_store = self.client.download_store
+        # Seconds a webplayback response is reused for if its asset URLs
+        # carry no expiry, and seconds before expiry it is refreshed at
+        self.webplayback_ttl = 600
+        self.webplayback_margin = 60
+        self._webplayback: dict[str, tuple[float, dict]] = {}
+        self._webplayback_lock = threading.Lock()
+        # Free space reserved after tags when they don't fit in place
+        self.tag_padding = 4096
+        # Seconds a fetched media playlist is reused for
+        self.playlist_ttl = 300
+        self._playlists: dict[str, tuple[float, m3u8.M3U8]] = {}
+        self._playlists_lock = threading.Lock()
         try:
             self.cdm = Cdm.from_device(
                 Device.load(self.client.widevine_device_path)
             )
-            self.cdm_session = self.cdm.open()
+            self.cdm_sessions = _CdmSessionPool(
+                self.cdm,
+                min(self.client.max_workers, Cdm.MAX_NUM_OF_SESSIONS),
+            )
         except FileNotFoundError:
             _log.warning(
                 "No Widevine Device File found, audio downloads will be"
                 " unavailable"
             )
 
-    def get_webplayback(self, song: Song) -> dict:
+    def get_webplayback(self, song: Song, refresh: bool = False) -> dict:
         """`dict`: Returns a song object with playback streams.
 
+        Responses are cached per song until shortly before their asset URLs
+        expire.
+
         Needs a Music User Token.
+
+        Arguments
+        ---------
+        song: `Song`
+            Song to get streams of.
+        refresh: `bool`
+            Ignore cached response.
         """
+        adam_id = song.play_params.id
+        now = time.time()
+        with self._webplayback_lock:
+            cached = self._webplayback.get(adam_id)
+        if not refresh and cached is not None and cached[0] > now:
+            return cached[1]
+        data = self._fetch_webplayback(song)
+        expires = min(
+            (
+                expiry
+                for asset in data["assets"]
+                if (expiry := _url_expiry(asset["URL"])) is not None
+            ),
+            default=now + self.webplayback_ttl,
+        )
+        with self._webplayback_lock:
+            for key, (valid_until, _) in list(self._webplayback.items()):
+                if valid_until <= now:
+                    del self._webplayback[key]
+            self._webplayback[adam_id] = (
+                expires - self.webplayback_margin,
+                data,
+            )
+        return data
+
+    def forget_webplayback(self, song: Song) -> None:
+        """Drops cached webplayback response of song."""
+        with self._webplayback_lock:
+            self._webplayback.pop(song.play_params.id, None)
+
+    def warm_webplayback(self, songs: list[Song]) -> int:
+        """`int`: Fetches webplayback responses of songs concurrently, returns
+        amount of cached songs.
+
+        Songs that fail are skipped and fetched again on download.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        songs: List[`Song`]
+            Songs to be downloaded soon.
+        """
+
+        def warm(song: Song) -> bool:
+            try:
+                self.get_webplayback(song)
+            except (
+                AssertionError,
+                AppleMusicAPIException,
+                requests.RequestException,
+                LookupError,
+                ValueError,
+            ) as e:
+                _log.warning(
+                    "failed to get webplayback of %s: %s",
+                    song.play_params.id,
+                    e,
+                )
+                return False
+            return True
+
+        with ThreadPoolExecutor(self.client.max_workers) as executor:
+            return sum(executor.map(warm, songs))
+
+    def _fetch_webplayback(self, song: Song) -> dict:
         with self.client.session.post(
             self.playback_url,
             json={
@@ -74,6 +230,91 @@ class PlaybackAPI:
         _log.debug("available streams: %s", result)
         return result
 
+    def flavor_selection(self) -> str:
+        """`str`: Returns key of current flavor selection settings.
+
+        Songs downloaded with equal keys get the same flavor, so the key
+        identifies downloads in `DownloadStore`.
+        """
+        match self.flavor_policy:
+            case None:
+                return self.default_flavor
+            case FlavorPolicy.MaxBitrate:
+                return f"{self.flavor_policy.value}:{self.max_bitrate}"
+        return self.flavor_policy.value
+
+    def select_flavor(
+        self,
+        song: Song,
+        policy: FlavorPolicy | None = None,
+        max_bitrate: int | None = None,
+    ) -> tuple[str, str]:
+        """(`str`,`str`): Returns flavor and stream URL picked by policy.
+
+        Bitrates are taken from flavor names like "28:ctrp256". If no flavor
+        fits the policy, the closest one is picked instead: the best stream for
+        `Best` and `BestLossless`, the smallest one otherwise.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        song: `Song`
+            Song to pick stream of.
+        policy: `FlavorPolicy`|`None`
+            Selection policy, `flavor_policy` by default. Without policy
+            `default_flavor` is picked if available, the best stream otherwise.
+        max_bitrate: `int`|`None`
+            Upper bitrate limit in kbps for `MaxBitrate`, `max_bitrate` by
+            default.
+        """
+        policy = policy or self.flavor_policy
+        if max_bitrate is None:
+            max_bitrate = self.max_bitrate
+        streams = self.get_available_streams(song)
+        if not streams:
+            raise AppleMusicAPIException({
+                "title": "No streams available",
+                "detail": f"song {song.play_params.id}",
+            })
+        # Ordered from worst to best, lossless ranks above any lossy bitrate
+        flavors = sorted(
+            streams,
+            key=lambda f: (
+                _is_lossless(f),
+                _flavor_bitrate(f),
+                f == self.default_flavor,
+            ),
+        )
+        lossy = [f for f in flavors if not _is_lossless(f)]
+        fallback = flavors[-1]
+        match policy:
+            case None:
+                candidates = [f for f in flavors if f == self.default_flavor]
+            case FlavorPolicy.Best:
+                candidates = flavors[::-1]
+            case FlavorPolicy.BestLossless:
+                candidates = []
+                if {
+                    AudioVariants.Lossless,
+                    AudioVariants.HiResLossless,
+                } & set(song.audio_traits):
+                    candidates = [f for f in flavors[::-1] if _is_lossless(f)]
+            case FlavorPolicy.SmallestAAC:
+                candidates = lossy
+                fallback = flavors[0]
+            case FlavorPolicy.MaxBitrate:
+                candidates = [
+                    f
+                    for f in lossy[::-1]
+                    if max_bitrate is None or _flavor_bitrate(f) <= max_bitrate
+                ]
+                fallback = (lossy or flavors)[0]
+        flavor = candidates[0] if candidates else fallback
+        if not candidates:
+            _log.debug("no flavor fits %s, falling back to %s", policy, flavor)
+        return flavor, streams[flavor]
+
     def get_license(self, challenge: str, track_url: str, track_id: str) -> str:
         """`str`: Returns a base64 encoded license key for track.
 
@@ -95,76 +336,669 @@ class PlaybackAPI:
             assert js["status"] == 0, "Error getting license"
             return js["license"]
 
-    def get_decryption_key(self, track_url: str, track_id: str) -> bytes:
+    def get_media_playlist(self, track_url: str) -> m3u8.M3U8:
+        """`m3u8.M3U8`: Returns parsed media playlist of track stream.
+
+        Playlist is fetched through client session and reused for
+        `playlist_ttl` seconds.
+
+        Arguments
+        ---------
+        track_url: `str`
+            Stream URL from `get_available_streams`.
+        """
+        now = time.monotonic()
+        with self._playlists_lock:
+            cached = self._playlists.get(track_url)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        with self.client.session.get(track_url) as resp:
+            playlist = m3u8.loads(resp.text, uri=track_url)
+        with self._playlists_lock:
+            for url, (expires, _) in list(self._playlists.items()):
+                if expires <= now:
+                    del self._playlists[url]
+            self._playlists[track_url] = (now + self.playlist_ttl, playlist)
+        return playlist
+
+    def get_decryption_key(
+        self,
+        track_url: str,
+        track_id: str,
+        playlist: m3u8.M3U8 | None = None,
+    ) -> bytes:
         """`bytes`: Returns a key for track.
 
+        Needs a Widevine device file.
+
+        Arguments
+        ---------
+        track_url: `str`
+            Stream URL from `get_available_streams`.
+        track_id: `str`
+            Adam ID of track.
+        playlist: `m3u8.M3U8`|`None`
+            Already parsed media playlist. Fetched if `None`.
+        """
+        if playlist is None:
+            playlist = self.get_media_playlist(track_url)
+        return self.get_key_for_uri(str(playlist.keys[0].uri), track_id)
+
+    def get_key_for_uri(self, key_url: str, track_id: str) -> bytes:
+        """`bytes`: Returns a key for `EXT-X-KEY` URI of track.
+
+        Key store is checked first, license is requested only for unknown keys.
+
         Needs a Widevine device file.
         """
-        playlist = m3u8.load(track_url)
-        key_url = str(playlist.keys[0].uri)
-        key = base64.b64decode(key_url.split(",")[1])
+        kid = key_url.split(",")[1]
+        if (stored := self.key_store.get(kid)) is not None:
+            _log.debug("using stored key for %s", kid)
+            return stored
+        key = base64.b64decode(kid)
         pssh_data = WidevinePsshData()
         pssh_data.algorithm = 1
         pssh_data.key_ids.append(key)
         pssh = PSSH(base64.b64encode(pssh_data.SerializeToString()).decode())
-        challenge = base64.b64encode(
-            self.cdm.get_license_challenge(self.cdm_session, pssh)
-        ).decode()
-        license_b64 = self.get_license(challenge, key_url, track_id)
-        self.cdm.parse_license(self.cdm_session, license_b64)
-        return next(
-            key
-            for key in self.cdm.get_keys(self.cdm_session)
-            if key.type == "CONTENT"
-        ).key
-
-    def get_encrypted_audio_with_key(self, song: Song) -> tuple[bytes, bytes]:
+        with self.cdm_sessions.checkout() as session_id:
+            challenge = base64.b64encode(
+                self.cdm.get_license_challenge(session_id, pssh)
+            ).decode()
+            license_b64 = self.get_license(challenge, key_url, track_id)
+            self.cdm.parse_license(session_id, license_b64)
+            content_key = next(
+                key
+                for key in self.cdm.get_keys(session_id)
+                if key.type == "CONTENT"
+            ).key
+        self.key_store.put(kid, content_key)
+        return content_key
+
+    def get_segment_ranges(
+        self, playlist: m3u8.M3U8, url: str
+    ) -> list[tuple[str, int | None, int | None]]:
+        """List[(`str`,`int`|`None`,`int`|`None`)]: Returns (url, offset, length)
+        of every media segment, including initialization sections.
+
+        Offset and length are `None` for segments without `EXT-X-BYTERANGE`.
+        """
+        ranges = []
+        end = 0
+        init_section = None
+
+        def parse(uri: str, byterange: str | None, default_start: int):
+            if byterange is None:
+                return urljoin(url, uri), None, None
+            length, _, offset = byterange.partition("@")
+            start = int(offset) if offset else default_start
+            return urljoin(url, uri), start, int(length)
+
+        for segment in playlist.segments:
+            if segment.init_section is not None:
+                init = (
+                    segment.init_section.uri,
+                    segment.init_section.byterange,
+                )
+                if init != init_section:
+                    init_section = init
+                    ranges.append(parse(*init, 0))
+            ranges.append(parse(segment.uri, segment.byterange, end))
+            if ranges[-1][1] is not None:
+                end = ranges[-1][1] + ranges[-1][2]
+        return ranges
+
+    def download_segment(
+        self, url: str, start: int | None = None, length: int | None = None
+    ) -> bytes:
+        """`bytes`: Downloads a media segment, verifying its size.
+
+        Arguments
+        ---------
+        url: `str`
+            Segment URL.
+        start: `int`|`None`
+            Byte range offset. Whole resource is downloaded if `None`.
+        length: `int`|`None`
+            Byte range length.
+        """
+        headers = {}
+        if start is not None and length is not None:
+            headers["Range"] = f"bytes={start}-{start + length - 1}"
+        with self.client.session.get(url, headers=headers) as resp:
+            data = resp.content
+        if length is not None and len(data) != length:
+            raise AppleMusicAPIException({
+                "code": resp.status_code,
+                "status": resp.status_code,
+                "title": "Segment size mismatch",
+                "detail": f"{url}: expected {length} bytes, got {len(data)}",
+            })
+        return data
+
+    def download_segments(
+        self,
+        ranges: list[tuple[str, int | None, int | None]],
+        workers: int | None = None,
+    ) -> bytes:
+        """`bytes`: Downloads media segments concurrently and joins them in order.
+
+        Arguments
+        ---------
+        ranges: List[(`str`,`int`|`None`,`int`|`None`)]
+            Segments as returned by `get_segment_ranges`.
+        workers: `int`|`None`
+            Amount of segments downloaded at once, `max_workers` by default.
+        """
+        return b"".join(self.iter_segments(ranges, workers))
+
+    def iter_segments(
+        self,
+        ranges: list[tuple[str, int | None, int | None]],
+        workers: int | None = None,
+    ) -> Iterator[bytes]:
+        """Iterator[`bytes`]: Downloads media segments concurrently, yields them in order.
+
+        At most `workers` segments are kept in memory.
+
+        Arguments
+        ---------
+        ranges: List[(`str`,`int`|`None`,`int`|`None`)]
+            Segments as returned by `get_segment_ranges`.
+        workers: `int`|`None`
+            Amount of segments downloaded at once, `max_workers` by default.
+        """
+        window = workers or self.client.max_workers
+        ranges_iter = iter(ranges)
+        with ThreadPoolExecutor(window) as executor:
+            pending = deque(
+                executor.submit(self.download_segment, *r)
+                for r in itertools.islice(ranges_iter, window)
+            )
+            while pending:
+                data = pending.popleft().result()
+                if (r := next(ranges_iter, None)) is not None:
+                    pending.append(executor.submit(self.download_segment, *r))
+                yield data
+
+    def get_encrypted_audio_with_key(
+        self, song: Song, work_dir: str | None = None
+    ) -> tuple[bytes, bytes]:
         """(`bytes`,`bytes`): Returns tuple of raw encrypted music data and decryption key.
 
         Needs a Music User Token.
 
         Needs a Widevine device file.
+
+        Arguments
+        ---------
+        song: `Song`
+            Song to download.
+        work_dir: `str`|`None`
+            Directory for download checkpoints. If set, downloaded segments are
+            kept there and an interrupted download continues from them. The
+            content key is kept there as well, sealed with the Music User
+            Token, so a resumed download needs no new license.
         """
+        data, key, _ = self._get_encrypted_audio(song, work_dir)
+        return data, key
+
+    def _get_encrypted_audio(
+        self, song: Song, work_dir: str | None
+    ) -> tuple[bytes, bytes, str]:
+        # Also returns downloaded flavor, so callers need no other request
+        if work_dir is not None:
+            return self._resumable_download(song, work_dir)
+        track_id = song.play_params.id
+        flavor, url = self.select_flavor(song)
+        playlist = self.get_media_playlist(url)
+        key = self.get_decryption_key(url, track_id, playlist)
+        ranges = self.get_segment_ranges(playlist, url)
+        return self.download_segments(ranges), key, flavor
+
+    def _resumable_download(
+        self, song: Song, work_dir: str
+    ) -> tuple[bytes, bytes, str]:
         track_id = song.play_params.id
-        flavors = self.get_available_streams(song)
-        url = flavors[self.default_flavor]
-        key = self.get_decryption_key(url, track_id)
-        playlist = m3u8.load(url)
-        path = url.replace(url.split("/")[-1], "") + "/"
-        part_url = playlist.segments[0]
-        with self.client.session.get(path + part_url.uri) as resp:
-            return resp.content, key
-
-    def get_decrypted_audio(self, song: Song) -> bytes:
+        job_dir = os.path.join(work_dir, track_id)
+        manifest_path = os.path.join(job_dir, "manifest.json")
+        os.makedirs(job_dir, exist_ok=True)
+        # Keys survive restarts with the checkpoints, whatever key_store is
+        job_keys = FileKeyStore(
+            os.path.join(job_dir, "keys"), self.client.user_token
+        )
+        manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            _log.debug("resuming download of %s", track_id)
+        # Compared without requests, so a valid manifest is resumed offline
+        selection = self.flavor_selection()
+        if manifest is None or manifest.get("selection") != selection:
+            flavor, _ = self.select_flavor(song)
+            manifest = self._new_manifest(song, flavor, selection, job_keys)
+            self._clear_parts(job_dir)
+            self._save_manifest(manifest_path, manifest)
+        elif (expiry := _url_expiry(manifest["url"])) and expiry <= time.time():
+            manifest = self._refresh_manifest(song, job_dir, manifest, job_keys)
+            self._save_manifest(manifest_path, manifest)
+        try:
+            self._download_parts(job_dir, manifest["ranges"])
+        except AppleMusicAPIException as e:
+            if str(e.status) not in ("403", "404", "410"):
+                raise
+            manifest = self._refresh_manifest(song, job_dir, manifest, job_keys)
+            self._save_manifest(manifest_path, manifest)
+            self._download_parts(job_dir, manifest["ranges"])
+        data = bytearray()
+        for i in range(len(manifest["ranges"])):
+            with open(os.path.join(job_dir, f"{i}.part"), "rb") as f:
+                data += f.read()
+        key = job_keys.get(manifest["key_uri"].split(",")[1])
+        if key is None:
+            key = self.get_key_for_uri(manifest["key_uri"], track_id)
+        shutil.rmtree(job_dir)
+        return bytes(data), key, manifest["flavor"]
+
+    def _refresh_manifest(
+        self, song: Song, job_dir: str, manifest: dict, job_keys: KeyStore
+    ) -> dict:
+        _log.info("stream url of %s expired, refreshing", song.play_params.id)
+        self.forget_webplayback(song)
+        refreshed = self._new_manifest(
+            song, manifest["flavor"], manifest["selection"], job_keys
+        )
+        # Downloaded parts are kept if the new stream has the same layout
+        old_layout = [r[1:] for r in manifest["ranges"]]
+        if [r[1:] for r in refreshed["ranges"]] != old_layout:
+            self._clear_parts(job_dir)
+        return refreshed
+
+    def _new_manifest(
+        self, song: Song, flavor: str, selection: str, job_keys: KeyStore
+    ) -> dict:
+        track_id = song.play_params.id
+        if (url := self.get_available_streams(song).get(flavor)) is None:
+            flavor, url = self.select_flavor(song)
+        playlist = self.get_media_playlist(url)
+        key_uri = str(playlist.keys[0].uri)
+        # Fetched now so an expired license fails before any segment
+        if job_keys.get(kid := key_uri.split(",")[1]) is None:
+            job_keys.put(kid, self.get_key_for_uri(key_uri, track_id))
+        ranges = self.get_segment_ranges(playlist, url)
+        return {
+            "adam_id": track_id,
+            "selection": selection,
+            "flavor": flavor,
+            "url": url,
+            "key_uri": key_uri,
+            "ranges": [list(r) for r in ranges],
+        }
+
+    def _save_manifest(self, path: str, manifest: dict) -> None:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def _clear_parts(self, job_dir: str) -> None:
+        for name in os.listdir(job_dir):
+            if name.endswith((".part", ".tmp")):
+                os.remove(os.path.join(job_dir, name))
+
+    def _download_parts(
+        self, job_dir: str, ranges: list[tuple[str, int | None, int | None]]
+    ) -> None:
+        def download(i: int) -> None:
+            url, start, length = ranges[i]
+            path = os.path.join(job_dir, f"{i}.part")
+            if os.path.exists(path) and (
+                length is None or os.path.getsize(path) == length
+            ):
+                return
+            data = self.download_segment(url, start, length)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+
+        with ThreadPoolExecutor(self.client.max_workers) as executor:
+            list(executor.map(download, range(len(ranges))))
+
+    def get_decrypted_audio(
+        self,
+        song: Song,
+        work_dir: str | None = None,
+        tags: TrackTags | None = None,
+    ) -> bytes:
         """`bytes`: Returns raw decrypted music data.
 
+        Tag inputs are fetched while the song is downloading. Songs found in
+        download store are not downloaded again.
+
         Needs a Music User Token.
 
         Needs a Widevine device file.
+
+        Arguments
+        ---------
+        song: `Song`
+            Song to download.
+        work_dir: `str`|`None`
+            Directory for download checkpoints, see `get_encrypted_audio_with_key`.
+        tags: `TrackTags`|`None`
+            Already known tag inputs, missing ones are fetched.
         """
-        encrypted, key = self.get_encrypted_audio_with_key(song)
-        inp_buf = io.BytesIO()
-        out_buf = io.BytesIO()
-        inp_buf.write(encrypted)
-        inp_buf.seek(0)
-        decrypt(key, inp_buf, out_buf)
-        out_buf.seek(0)
-        with_tags = self.apply_tags(song, out_buf.getbuffer())
-        return with_tags
-
-    def apply_tags(self, meta_song: Song, data: bytes) -> bytes:
-        f = io.BytesIO()
-        f.write(data)
-        f.seek(0)
-        song = MP4(f)
+        with ThreadPoolExecutor(1) as executor:
+            tags_future = executor.submit(self.fetch_tags, song, tags)
+            out_buf = io.BytesIO()
+            store = self.download_store
+            selection = self.flavor_selection()
+            if (
+                store is not None
+                and (stored := store.lookup(song, selection)) is not None
+            ):
+                with open(stored, "rb") as f:
+                    shutil.copyfileobj(f, out_buf)
+                return self.apply_tags(song, out_buf, tags_future.result())
+            encrypted, key, flavor = self._get_encrypted_audio(song, work_dir)
+            # BytesIO shares unmodified bytes instead of copying them
+            decrypt(key, io.BytesIO(encrypted), out_buf, self.decrypt_workers)
+            del encrypted
+            if store is not None:
+                with out_buf.getbuffer() as data:
+                    store.add_bytes(song, selection, flavor, data)
+            return self.apply_tags(song, out_buf, tags_future.result())
+
+    def download_to(
+        self,
+        song: Song,
+        target: str | BinaryIO,
+        tags: bool | TrackTags = True,
+        workers: int | None = None,
+    ) -> None:
+        """Downloads, decrypts and writes song to a file path or a file object.
+
+        Fragments are decrypted and written as segments arrive, so memory usage
+        doesn't depend on song size. Tag inputs are fetched while the song is
+        downloading and applied to the written file in place, file objects have
+        to be readable and seekable for that. Paths are written through a
+        temporary file, so a failed download leaves no partial file behind.
+
+        Songs found in download store are copied from there without any
+        request. Untagged outputs may be hard links to stored files and must
+        not be modified.
+
+        Needs a Music User Token.
+
+        Needs a Widevine device file.
+
+        Arguments
+        ---------
+        song: `Song`
+            Song to download.
+        target: `str`|`BinaryIO`
+            Output file path or file object opened for writing.
+        tags: `bool`|`TrackTags`
+            Apply metadata tags. Already known tag inputs can be passed instead
+            of `True`, missing ones are fetched.
+        workers: `int`|`None`
+            Amount of segments downloaded at once, `max_workers` by default.
+        """
+        path: str | None = None
+        out: BinaryIO | None = None
+        if isinstance(target, (str, os.PathLike)):
+            path = os.fspath(target)
+        else:
+            out = target
+        store = self.download_store
+        selection = self.flavor_selection()
+        stored = None
+        if store is not None:
+            stored = store.lookup(song, selection)
+        with ThreadPoolExecutor(1) as executor:
+            tags_future = None
+            if tags is not False:
+                tags_future = executor.submit(
+                    self.fetch_tags, song, None if tags is True else tags
+                )
+            if stored is not None and path is not None:
+                clone_file(stored, path, hardlink=tags is False)
+            elif stored is not None and out is not None:
+                with open(stored, "rb") as f:
+                    shutil.copyfileobj(f, out)
+            elif stored is None:
+                track_id = song.play_params.id
+                flavor, url = self.select_flavor(song)
+                playlist = self.get_media_playlist(url)
+                key = self.get_decryption_key(url, track_id, playlist)
+                ranges = self.get_segment_ranges(playlist, url)
+                reader = _ChunkReader(self.iter_segments(ranges, workers))
+                if path is not None:
+                    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                    try:
+                        with open(tmp_path, "wb") as f:
+                            decrypt(key, reader, f, self.decrypt_workers)
+                        os.replace(tmp_path, path)
+                    except BaseException:
+                        with contextlib.suppress(FileNotFoundError):
+                            os.remove(tmp_path)
+                        raise
+                    if store is not None:
+                        store.add_file(song, selection, flavor, path)
+                elif out is not None:
+                    decrypt(key, reader, out, self.decrypt_workers)
+            if tags_future is not None:
+                self.tag_file(song, target, tags_future.result())
+
+    def download_album(
+        self, album: Album, dest: str | os.PathLike, workers: int = 4
+    ) -> list[str]:
+        """List[`str`]: Downloads all songs of album to a directory, returns
+        written file paths in album order.
+
+        Track list, album and artwork are fetched once and shared by all
+        songs, songs are downloaded in parallel. Files are named
+        "disc-track name.m4a".
+
+        Needs a Music User Token.
+
+        Needs a Widevine device file.
+
+        Arguments
+        ---------
+        album: `Album`
+            Catalog album to download.
+        dest: `str`
+            Output directory. Created if missing.
+        workers: `int`
+            Amount of songs downloaded at once.
+        """
+        os.makedirs(dest, exist_ok=True)
+        with ThreadPoolExecutor(2) as executor:
+            artwork = executor.submit(self.client.catalog.get_artwork, album)
+            songs = self.client.catalog.album_tracks(album)
+            tags = TrackTags(album=album, artwork=artwork.result())
+
+        # Songs share the client's connection pool
+        segment_workers = max(1, self.client.max_workers // workers)
+
+        def download(song: Song) -> str:
+            name = safe_filename(song.name)
+            path = os.path.join(
+                dest, f"{song.disc_number}-{song.track_number:02d} {name}.m4a"
+            )
+            self.download_to(song, path, tags, segment_workers)
+            return path
+
+        with ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(download, songs))
+
+    def fetch_tags(
+        self, meta_song: Song, tags: TrackTags | None = None
+    ) -> TrackTags:
+        """`TrackTags`: Fetches missing tag inputs of song concurrently.
+
+        Arguments
+        ---------
+        meta_song: `Song`
+            Song to fetch tag inputs of.
+        tags: `TrackTags`|`None`
+            Already known tag inputs, not fetched again. Returned as is if
+            they were fetched already.
+        """
+        if tags is not None and tags.fetched:
+            return tags
+        tags = tags.model_copy() if tags is not None else TrackTags()
+        futures: dict[str, Future] = {}
+        with ThreadPoolExecutor(3) as executor:
+            if tags.album is None:
+                futures["album"] = executor.submit(meta_song.album)
+            if tags.lyrics is None and meta_song.has_lyrics:
+                futures["lyrics"] = executor.submit(meta_song.lyrics)
+            if tags.artwork is None:
+                futures["artwork"] = executor.submit(meta_song.get_artwork)
+        for name, future in futures.items():
+            setattr(tags, name, future.result())
+        tags.fetched = True
+        return tags
+
+    def tag_file(
+        self,
+        meta_song: Song,
+        target: str | BinaryIO,
+        tags: TrackTags | None = None,
+    ) -> None:
+        """Writes song metadata to a file path or a file object in place.
+
+        Arguments
+        ---------
+        meta_song: `Song`
+            Song to take metadata from.
+        target: `str`|`BinaryIO`
+            MP4 file path or readable, writable and seekable file object.
+        tags: `TrackTags`|`None`
+            Already known tag inputs, missing ones are fetched.
+        """
+        song = MP4(target)
+        if tags is None or not tags.fetched:
+            tags = self.fetch_tags(meta_song, tags)
+        self._fill_tags(song, meta_song, tags)
+        song.save(target, padding=self._tag_padding)
+
+    def apply_tags(
+        self,
+        meta_song: Song,
+        data: bytes | io.BytesIO,
+        tags: TrackTags | None = None,
+    ) -> bytes:
+        """`bytes`: Returns song data with metadata tags.
+
+        Buffers are tagged in place, bytes are copied once.
+
+        Arguments
+        ---------
+        meta_song: `Song`
+            Song to take metadata from.
+        data: `bytes`|`io.BytesIO`
+            MP4 file data.
+        tags: `TrackTags`|`None`
+            Already known tag inputs, missing ones are fetched.
+        """
+        f = data if isinstance(data, io.BytesIO) else io.BytesIO(data)
+        self.tag_file(meta_song, f, tags)
+        return f.getbuffer()
+
+    def _tag_padding(self, info: PaddingInfo) -> int:
+        # Existing free space is kept as is, shrinking it would move the audio
+        # data after the tags as well
+        if info.padding >= 0:
+            return info.padding
+        return self.tag_padding
+
+    def _fill_tags(self, song: MP4, meta_song: Song, tags: TrackTags) -> None:
         song["\xa9nam"] = meta_song.name
         song["\xa9alb"] = meta_song.album_name
         song["\xa9ART"] = meta_song.artist_name
         song["aART"] = meta_song.artist_name
         song["\xa9day"] = meta_song.release_date
-        song["\xa9gen"] = meta_song.genre_names[0]
-        song["\xa9lyr"] = str(meta_song.lyrics())
-        song["trkn"] = [[meta_song.track_number, meta_song.album().track_count]]
-        song["covr"] = [MP4Cover(meta_song.get_artwork())]
-        song.save(f)
-        return f.getbuffer()
+        if meta_song.genre_names:
+            song["\xa9gen"] = meta_song.genre_names[0]
+        if tags.lyrics is not None:
+            song["\xa9lyr"] = str(tags.lyrics)
+        # Track total 0 means unknown
+        track_count = tags.album.track_count if tags.album is not None else 0
+        song["trkn"] = [[meta_song.track_number, track_count]]
+        if tags.artwork:
+            song["covr"] = [MP4Cover(tags.artwork)]
+
+
+def _flavor_bitrate(flavor: str) -> int:
+    """Returns bitrate in kbps from flavor name, 0 if it has none."""
+    if match := re.search(r"(\d+)$", flavor.partition(":")[2]):
+        return int(match.group(1))
+    return 0
+
+
+def _is_lossless(flavor: str) -> bool:
+    return "alac" in flavor.lower() or "lossless" in flavor.lower()
+
+
+def _url_expiry(url: str) -> float | None:
+    """Returns expiry timestamp of a signed URL, if it carries one."""
+    for name, value in parse_qsl(urlsplit(url).query):
+        # Expiry is either its own parameter or a field of a token parameter
+        if name.lower() in ("e", "exp", "expires") and value.isdigit():
+            return float(value)
+        if match := re.search(r"(?:^|[~&:])exp=(\d+)", value):
+            return float(match.group(1))
+    return None
+
+
+class _CdmSessionPool:
+    """Bounded pool of CDM sessions.
+
+    Every license operation checks out a session of its own, so concurrent
+    downloads never share key state. Sessions are opened on demand, reused
+    after successful operations and closed after failed ones.
+    """
+
+    def __init__(self, cdm: Cdm, size: int) -> None:
+        self.cdm = cdm
+        self.idle: queue.LifoQueue[bytes] = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def checkout(self) -> Iterator[bytes]:
+        with self.slots:
+            try:
+                session_id = self.idle.get_nowait()
+            except queue.Empty:
+                session_id = self.cdm.open()
+            try:
+                yield session_id
+            except BaseException:
+                try:
+                    self.cdm.close(session_id)
+                except Exception:
+                    _log.debug("failed to close cdm session", exc_info=True)
+                raise
+            self.idle.put(session_id)
+
+
+class _ChunkReader(io.RawIOBase):
+    """Readable stream over an iterator of byte chunks."""
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self.chunks = chunks
+        self.buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            if (chunk := next(self.chunks, None)) is None:
+                return 0
+            self.buffer = memoryview(chunk)
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
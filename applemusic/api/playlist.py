@@ -1,11 +1,21 @@
 from __future__ import annotations
 
 import logging
-from typing import TYPE_CHECKING
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Iterator
 
+from requests import RequestException
+
+from applemusic.errors import AppleMusicAPIException
 from applemusic.models.meta import CatalogTypes, LibraryTypes
-from applemusic.models.playlist import LibraryPlaylist, Playlist
+from applemusic.models.playlist import (
+    LibraryPlaylist,
+    Playlist,
+    PlaylistSyncResult,
+)
 from applemusic.models.song import LibrarySong, Song
+from applemusic.utils import chunked
 
 if TYPE_CHECKING:
     from applemusic.client import ApiClient
@@ -18,6 +28,47 @@ class PlaylistAPI:
 
     def __init__(self, client: ApiClient) -> None:
         self.client = client
+        # playlist id -> (last modified date, track ids)
+        self._track_ids: dict[str, tuple[str, set[str]]] = {}
+        self._track_ids_lock = threading.Lock()
+
+    def _cache_track_ids(
+        self,
+        playlist: LibraryPlaylist | Playlist,
+        tracks: list[Song | LibrarySong],
+    ) -> set[str]:
+        track_ids = {t.id for t in tracks}
+        with self._track_ids_lock:
+            self._track_ids[playlist.id] = (
+                playlist.last_modified_date,
+                track_ids,
+            )
+        return track_ids
+
+    def _cached_track_ids(
+        self, playlist: LibraryPlaylist | Playlist
+    ) -> set[str] | None:
+        with self._track_ids_lock:
+            cached = self._track_ids.get(playlist.id)
+            if cached is None:
+                return None
+            modified, track_ids = cached
+            if modified != playlist.last_modified_date:
+                _log.debug("track cache for %s expired", playlist.id)
+                del self._track_ids[playlist.id]
+                return None
+            return track_ids
+
+    def forget_tracks(self, playlist: LibraryPlaylist | Playlist) -> None:
+        """Drops cached track IDs of playlist.
+
+        Arguments
+        ---------
+        playlist: `LibraryPlaylist`|`Playlist`
+            Playlist to forget.
+        """
+        with self._track_ids_lock:
+            self._track_ids.pop(playlist.id, None)
 
     def list_playlists(self) -> list[LibraryPlaylist]:
         """List[`Playlist`]: Returns a list of library playlists.
@@ -26,21 +77,71 @@ class PlaylistAPI:
 
         Needs a Music User Token.
         """
-        playlists = []
+        return list(self.iter_playlists())
+
+    def _iter_playlist_data(self, params: dict | None = None) -> Iterator[dict]:
         url = "/v1/me/library/playlists"
         while True:
             with self.client.session.get(
-                self.client.session.base_url + url
+                self.client.session.base_url + url, params=params
             ) as resp:
                 js = resp.json()
                 _log.debug("playlist list response: %s", js)
-                for p in js["data"]:
-                    playlist = LibraryPlaylist(self.client, **p)
-                    playlists.append(playlist)
-                if url := js.get("next", False):
-                    pass
+                yield from js["data"]
+                if not (url := js.get("next", False)):
+                    return
+
+    def crawl_playlists(
+        self,
+    ) -> Iterator[tuple[LibraryPlaylist, list[LibrarySong]]]:
+        """Iterator[(`LibraryPlaylist`, List[`LibrarySong`])]: Yields every
+        library playlist together with its tracks.
+
+        Playlists are requested with included tracks. Remaining track pages
+        are fetched concurrently across playlists, so pairs are yielded in
+        completion order. Refreshes cached track IDs of every playlist.
+
+        Needs a Music User Token.
+        """
+
+        def finish(
+            playlist: LibraryPlaylist, tracks: list, url: str | None
+        ) -> tuple[LibraryPlaylist, list[LibrarySong]]:
+            if url is not None:
+                tracks.extend(self._iter_tracks(url))
+            self._cache_track_ids(playlist, tracks)
+            return playlist, tracks
+
+        with ThreadPoolExecutor(self.client.max_workers) as executor:
+            pending = set()
+            for p in self._iter_playlist_data({"include": "tracks"}):
+                playlist = LibraryPlaylist(self.client, **p)
+                included = p.get("relationships", {}).get("tracks")
+                if included is None:
+                    url = f"/v1/me/library/playlists/{playlist.id}/tracks"
+                    tracks = []
                 else:
-                    return playlists
+                    url = included.get("next")
+                    tracks = self._parse_tracks(included.get("data", []))
+                if url is None:
+                    yield finish(playlist, tracks, None)
+                    continue
+                pending.add(executor.submit(finish, playlist, tracks, url))
+                for future in [f for f in pending if f.done()]:
+                    pending.remove(future)
+                    yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+
+    def iter_playlists(self) -> Iterator[LibraryPlaylist]:
+        """Iterator[`LibraryPlaylist`]: Yields library playlists page by page.
+
+        Internally limited by 25 playlists per request.
+
+        Needs a Music User Token.
+        """
+        for p in self._iter_playlist_data():
+            yield LibraryPlaylist(self.client, **p)
 
     def create_playlist(
         self, name: str, description: str = ""
@@ -91,10 +192,46 @@ class PlaylistAPI:
             return resp.status_code == 204
 
     def add_to_playlist(
-        self, playlist: LibraryPlaylist, songs: list[Song | LibrarySong]
+        self,
+        playlist: LibraryPlaylist,
+        songs: list[Song | LibrarySong],
+        chunk_size: int = 100,
+        retries: int = 2,
     ) -> bool:
         """`bool`: Adds songs to playlist.
 
+        Large lists are split into chunks, see `add_to_playlist_chunked`.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        playlist: `LibraryPlaylist`
+            Playlist to add songs to.
+        songs: List[`Song`|`LibrarySong`]
+            List of songs to add to playlist.
+        chunk_size: `int`
+            Amount of songs per request.
+        retries: `int`
+            Amount of retries for a failed chunk.
+        """
+        return all(
+            self.add_to_playlist_chunked(playlist, songs, chunk_size, retries)
+        )
+
+    def add_to_playlist_chunked(
+        self,
+        playlist: LibraryPlaylist,
+        songs: list[Song | LibrarySong],
+        chunk_size: int = 100,
+        retries: int = 2,
+    ) -> list[bool]:
+        """List[`bool`]: Adds songs to playlist, returns result for every chunk.
+
+        Chunks are sent one after another to keep track order. Only a failed
+        chunk is retried. If it still fails, the following chunks are not sent
+        and reported as failed, so the call can be resumed from that chunk.
+
         Needs a Music User Token.
 
         Arguments
@@ -103,7 +240,34 @@ class PlaylistAPI:
             Playlist to add songs to.
         songs: List[`Song`|`LibrarySong`]
             List of songs to add to playlist.
+        chunk_size: `int`
+            Amount of songs per request.
+        retries: `int`
+            Amount of retries for a failed chunk.
         """
+        chunks = list(chunked(songs, chunk_size))
+        results = []
+        for chunk in chunks:
+            for attempt in range(retries + 1):
+                try:
+                    if self._add_chunk(playlist, chunk):
+                        break
+                except (AppleMusicAPIException, RequestException) as e:
+                    _log.warning(
+                        "adding chunk to %s failed: %s", playlist.id, e
+                    )
+                if attempt < retries:
+                    _log.debug("retrying chunk, attempt %s", attempt + 1)
+            else:
+                results.append(False)
+                break
+            results.append(True)
+        results.extend([False] * (len(chunks) - len(results)))
+        return results
+
+    def _add_chunk(
+        self, playlist: LibraryPlaylist, songs: list[Song | LibrarySong]
+    ) -> bool:
         tracks_to_add = []
         for s in songs:
             t = None
@@ -119,31 +283,60 @@ class PlaylistAPI:
         ) as resp:
             if resp.text != "":
                 _log.debug("add to playlist response: %s", resp.json())
-            return resp.status_code == 201
+            if resp.status_code != 201:
+                return False
+        if any(not isinstance(s, LibrarySong) for s in songs):
+            # Library IDs of added catalog songs are unknown
+            self.forget_tracks(playlist)
+        else:
+            with self._track_ids_lock:
+                if (cached := self._track_ids.get(playlist.id)) is not None:
+                    cached[1].update(s.id for s in songs)
+        return True
 
     def delete_from_playlist(
-        self, playlist: LibraryPlaylist, song: LibrarySong
+        self,
+        playlist: LibraryPlaylist,
+        songs: LibrarySong | list[LibrarySong],
+        chunk_size: int = 100,
     ) -> bool:
-        """`bool`: Adds songs to playlist.
+        """`bool`: Removes songs from playlist.
+
+        Songs are removed in chunks of `chunk_size`, chunks are sent concurrently.
 
         Needs a Music User Token.
 
         Arguments
         ---------
         playlist: `LibraryPlaylist`
-            Playlist to add songs to.
-        song: `LibrarySong`
-            Song to remove from playlist.
+            Playlist to remove songs from.
+        songs: `LibrarySong`|List[`LibrarySong`]
+            Song or list of songs to remove from playlist.
+        chunk_size: `int`
+            Amount of songs per request.
         """
-        with self.client.session.delete(
-            self.client.session.base_url
-            + f"/v1/me/library/playlists/{playlist.id}/tracks",
-            params={"ids[library-songs]": song.id, "mode": "all"},
-        ) as resp:
-            js = resp.json()
-            if resp.text != "":
-                _log.debug("remove from playlist response: %s", js)
-            return resp.status_code == 204
+        if isinstance(songs, LibrarySong):
+            songs = [songs]
+        song_ids = list(dict.fromkeys(s.id for s in songs))
+
+        def delete(ids: list[str]) -> bool:
+            with self.client.session.delete(
+                self.client.session.base_url
+                + f"/v1/me/library/playlists/{playlist.id}/tracks",
+                params={"ids[library-songs]": ",".join(ids), "mode": "all"},
+            ) as resp:
+                if resp.text != "":
+                    _log.debug("remove from playlist response: %s", resp.json())
+                if resp.status_code != 204:
+                    return False
+            with self._track_ids_lock:
+                if (cached := self._track_ids.get(playlist.id)) is not None:
+                    cached[1].difference_update(ids)
+            return True
+
+        with ThreadPoolExecutor(self.client.max_workers) as executor:
+            results = list(executor.map(delete, chunked(song_ids, chunk_size)))
+        return all(results)
 
     def list_tracks(
         self, playlist: LibraryPlaylist | Playlist
@@ -151,37 +344,71 @@ class PlaylistAPI:
         """List[`LibrarySong`|`Song`]: Returns a list of library songs.
 
         Internally limited by 100 songs per request.
+        Refreshes cached track IDs of the playlist.
         """
-        res = []
         if isinstance(playlist, LibraryPlaylist):
             url = f"/v1/me/library/playlists/{playlist.id}/tracks"
         elif isinstance(playlist, Playlist):
             url = f"/v1/catalog/{self.client.storefront}/playlists/{playlist.id}/tracks"
+        res = list(self._iter_tracks(url))
+        self._cache_track_ids(playlist, res)
+        return res
+
+    def iter_tracks(
+        self, playlist: LibraryPlaylist | Playlist
+    ) -> Iterator[Song | LibrarySong]:
+        """Iterator[`LibrarySong`|`Song`]: Yields playlist tracks page by page.
+
+        Internally limited by 100 songs per request.
+        Unlike `list_tracks`, doesn't touch cached track IDs.
+        """
+        if isinstance(playlist, LibraryPlaylist):
+            url = f"/v1/me/library/playlists/{playlist.id}/tracks"
+        elif isinstance(playlist, Playlist):
+            url = f"/v1/catalog/{self.client.storefront}/playlists/{playlist.id}/tracks"
+        yield from self._iter_tracks(url)
+
+    def _iter_tracks(self, url: str) -> Iterator[Song | LibrarySong]:
+        # Empty library playlists have no tracks resource, a missing catalog
+        # playlist is an error though
+        empty_allowed = url.startswith("/v1/me/library/playlists/")
         while True:
-            with self.client.session.get(
-                self.client.session.base_url + url
-            ) as resp:
+            try:
+                resp = self.client.session.get(
+                    self.client.session.base_url + url
+                )
+            except AppleMusicAPIException as e:
+                if empty_allowed and str(e.status) == "404":
+                    return
+                raise
+            empty_allowed = False
+            with resp:
                 js = resp.json()
                 _log.debug("playlist tracks response: %s", js)
-                tracks = js["data"]
-                for t in tracks:
-                    match t["type"]:
-                        case "library-songs":
-                            track = LibrarySong(self.client, **t)
-                        case "songs":
-                            track = Song(self.client, **t)
-                    res.append(track)
+                yield from self._parse_tracks(js["data"])
                 if url := js.get("next", False):
                     pass
                 else:
-                    return res
+                    return
+
+    def _parse_tracks(self, tracks: list[dict]) -> list[Song | LibrarySong]:
+        res = []
+        for t in tracks:
+            match t["type"]:
+                case "library-songs":
+                    track = LibrarySong(self.client, **t)
+                case "songs":
+                    track = Song(self.client, **t)
+            res.append(track)
+        return res
 
     def in_playlist(
         self, playlist: LibraryPlaylist | Playlist, song: LibrarySong | Song
     ) -> bool:
         """`bool`: If song is in specified playlist.
 
-        Could be slow.
+        Track IDs are loaded once and cached until playlist's
+        `last_modified_date` changes.
 
         Arguments
         ---------
@@ -190,8 +417,80 @@ class PlaylistAPI:
         song: `LibrarySong`|`Song`
             Song to search for.
         """
-        tracks = self.list_tracks(playlist)
-        for t in tracks:
-            if t.id == song.id:
-                return True
-        return False
+        if (track_ids := self._cached_track_ids(playlist)) is None:
+            track_ids = {t.id for t in self.list_tracks(playlist)}
+        return song.id in track_ids
+
+    def sync(
+        self,
+        playlist: LibraryPlaylist,
+        target_songs: list[Song | LibrarySong],
+        dry_run: bool = False,
+    ) -> PlaylistSyncResult:
+        """`PlaylistSyncResult`: Makes playlist contain exactly `target_songs`.
+
+        Songs are matched by catalog ID when available, by library ID otherwise.
+        Missing songs are appended and tracks that are not in `target_songs`
+        are removed in batches. Catalog tracks can't be removed, they are
+        reported in `not_removable` instead. Existing tracks are not reordered.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        playlist: `LibraryPlaylist`
+            Playlist to synchronize.
+        target_songs: List[`Song`|`LibrarySong`]
+            Desired playlist contents.
+        dry_run: `bool`
+            Only compute the changes, don't send them.
+        """
+
+        def key(song: Song | LibrarySong) -> str:
+            if isinstance(song, LibrarySong) and song.play_params.catalog_id:
+                return song.play_params.catalog_id
+            return song.id
+
+        current = self.list_tracks(playlist)
+        current_keys = {key(t) for t in current}
+        target_keys = set()
+        to_add = []
+        for song in target_songs:
+            k = key(song)
+            if k in target_keys:
+                continue
+            target_keys.add(k)
+            if k not in current_keys:
+                to_add.append(song)
+        to_remove: list[LibrarySong] = []
+        not_removable: list[Song] = []
+        unwanted_ids = set()
+        for track in current:
+            if key(track) in target_keys or track.id in unwanted_ids:
+                continue
+            unwanted_ids.add(track.id)
+            # Tracks are removed by library ID, catalog tracks have none
+            if isinstance(track, LibrarySong):
+                to_remove.append(track)
+            else:
+                not_removable.append(track)
+        result = PlaylistSyncResult(
+            added=to_add,
+            removed=to_remove,
+            not_removable=not_removable,
+            kept=len(current) - sum(1 for t in current if t.id in unwanted_ids),
+        )
+        _log.debug(
+            "sync %s: %s to add, %s to remove, %s not removable",
+            playlist.id,
+            len(to_add),
+            len(to_remove),
+            len(not_removable),
+        )
+        if dry_run:
+            return result
+        if to_remove:
+            result.success &= self.delete_from_playlist(playlist, to_remove)
+        if to_add:
+            result.success &= self.add_to_playlist(playlist, to_add)
+        return result
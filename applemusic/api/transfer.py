@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from contextlib import ExitStack
+from typing import TYPE_CHECKING, Iterator
+
+from applemusic.models.meta import CatalogTypes, LibraryTypes
+from applemusic.models.playlist import LibraryPlaylist
+from applemusic.models.song import LibrarySong, Song
+from applemusic.utils import chunked, safe_filename
+
+if TYPE_CHECKING:
+    from applemusic.client import ApiClient
+
+_log = logging.getLogger(__name__)
+
+
+class TransferAPI:
+    """Streaming export and import of library and playlists.
+
+    Library and playlists are written to NDJSON files, one object per line.
+    Playlists can also be written as extended M3U8 files. Objects are written
+    as pages arrive and read back line by line, so memory usage doesn't grow
+    with library size.
+    """
+
+    def __init__(self, client: ApiClient) -> None:
+        self.client = client
+
+    def _dump(self, obj: Song | LibrarySong | LibraryPlaylist) -> str:
+        return json.dumps(
+            obj.model_dump(mode="json", by_alias=True), ensure_ascii=False
+        )
+
+    def _read(self, path: str | os.PathLike) -> Iterator[dict]:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _song_location(self, song: Song | LibrarySong) -> str:
+        if isinstance(song, Song):
+            return song.url
+        if catalog_id := song.play_params.catalog_id:
+            return (
+                f"https://music.apple.com/{self.client.storefront}/song/"
+                f"{catalog_id}"
+            )
+        return song.href
+
+    def export_library(self, path: str | os.PathLike) -> int:
+        """`int`: Writes library songs to NDJSON file, returns amount of songs.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        path: `str`
+            Output file path.
+        """
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for song in self.client.library.iter_songs():
+                f.write(self._dump(song) + "\n")
+                count += 1
+        _log.debug("exported %s library songs", count)
+        return count
+
+    def export_playlists(
+        self, path: str | os.PathLike, m3u_dir: str | os.PathLike | None = None
+    ) -> int:
+        """`int`: Writes library playlists to NDJSON file, returns amount of playlists.
+
+        Every playlist line is followed by lines of its tracks.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        path: `str`
+            Output file path.
+        m3u_dir: `str`|`None`
+            Directory for extended M3U8 file per playlist. Not written if `None`.
+        """
+        count = 0
+        if m3u_dir is not None:
+            os.makedirs(m3u_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for playlist in self.client.playlist.iter_playlists():
+                f.write(self._dump(playlist) + "\n")
+                with ExitStack() as stack:
+                    m3u = None
+                    if m3u_dir is not None:
+                        name = safe_filename(playlist.name)
+                        m3u = stack.enter_context(
+                            open(
+                                os.path.join(
+                                    m3u_dir, f"{name} ({playlist.id}).m3u8"
+                                ),
+                                "w",
+                                encoding="utf-8",
+                            )
+                        )
+                        m3u.write(f"#EXTM3U\n#PLAYLIST:{playlist.name}\n")
+                    for track in self.client.playlist.iter_tracks(playlist):
+                        f.write(self._dump(track) + "\n")
+                        if m3u is not None:
+                            m3u.write(
+                                f"#EXTINF:{track.duration_in_millis // 1000},"
+                                f"{track.artist_name} - {track.name}\n"
+                                f"{self._song_location(track)}\n"
+                            )
+                count += 1
+        _log.debug("exported %s playlists", count)
+        return count
+
+    def import_library(
+        self, path: str | os.PathLike, chunk_size: int = 100
+    ) -> int:
+        """`int`: Adds songs from NDJSON export to library, returns amount of songs.
+
+        Songs without catalog counterpart are skipped.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        path: `str`
+            NDJSON file written by `export_library`.
+        chunk_size: `int`
+            Amount of songs per request.
+        """
+        count = 0
+
+        def catalog_ids() -> Iterator[str]:
+            for data in self._read(path):
+                song = LibrarySong(self.client, **data)
+                if catalog_id := song.play_params.catalog_id:
+                    yield catalog_id
+
+        # One batch fills every worker of add_by_ids with a chunk
+        batch_size = chunk_size * self.client.max_workers
+        for ids in chunked(catalog_ids(), batch_size):
+            if self.client.library.add_by_ids(
+                ids, CatalogTypes.Songs, chunk_size
+            ):
+                count += len(ids)
+            else:
+                _log.warning("failed to add %s songs to library", len(ids))
+        return count
+
+    def import_playlists(
+        self, path: str | os.PathLike, chunk_size: int = 100
+    ) -> int:
+        """`int`: Creates playlists from NDJSON export, returns amount of playlists.
+
+        Tracks are restored by their IDs, so the export should come from the same
+        account or contain catalog songs.
+
+        Needs a Music User Token.
+
+        Arguments
+        ---------
+        path: `str`
+            NDJSON file written by `export_playlists`.
+        chunk_size: `int`
+            Amount of songs per request.
+        """
+        count = 0
+        playlist = None
+        pending: list[Song | LibrarySong] = []
+
+        def flush() -> None:
+            if playlist and pending:
+                if not self.client.playlist.add_to_playlist(
+                    playlist, pending, chunk_size
+                ):
+                    _log.warning("failed to add tracks to %s", playlist.id)
+            pending.clear()
+
+        for data in self._read(path):
+            match data["type"]:
+                case LibraryTypes.Playlists.value:
+                    flush()
+                    source = LibraryPlaylist(self.client, **data)
+                    playlist = self.client.playlist.create_playlist(
+                        source.name, source.description.standard
+                    )
+                    if playlist:
+                        count += 1
+                    else:
+                        _log.warning("failed to create %s", source.name)
+                case LibraryTypes.Songs.value:
+                    pending.append(LibrarySong(self.client, **data))
+                case CatalogTypes.Songs.value:
+                    pending.append(Song(self.client, **data))
+            if len(pending) >= chunk_size:
+                flush()
+        flush()
+        return count
@@ -3,13 +3,16 @@ import time
 from functools import wraps
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from applemusic.api.account import AccountAPI
 from applemusic.api.catalog import CatalogAPI
 from applemusic.api.library import LibraryAPI
 from applemusic.api.playback import PlaybackAPI
 from applemusic.api.playlist import PlaylistAPI
+from applemusic.api.transfer import TransferAPI
 from applemusic.errors import AppleMusicAPIException
+from applemusic.keystore import MemoryKeyStore
 
 _log = logging.getLogger(__name__)
 
@@ -25,6 +28,8 @@ class Session:
         Music User Token for library interaction.
     verify_ssl: bool
         SSL verification for debug purposes.
+    pool_size: int
+        Maximum number of pooled connections per host.
 
     Methods
     -------
@@ -36,8 +41,13 @@ class Session:
         requests.delete() wrapper.
     """
 
-    def __init__(self, dev_token, user_token, verify_ssl) -> None:
+    def __init__(self, dev_token, user_token, verify_ssl, pool_size=10) -> None:
         self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.session.verify = verify_ssl
         self.session.headers["origin"] = "https://music.apple.com"
         self.session.headers["Authorization"] = f"Bearer {dev_token}"
@@ -56,16 +66,17 @@ class Session:
                     _log.warning("Got ratelimited, sleeping a bit")
                     time.sleep(1)
                 elif resp.status_code >= 400:
-                    if len(resp.text):
+                    try:
                         error = resp.json()["errors"][0]
-                        raise AppleMusicAPIException(error)
-                    else:
-                        raise AppleMusicAPIException({
+                    except (ValueError, KeyError, IndexError, TypeError):
+                        # Empty or non-API bodies, e.g. CDN error pages
+                        error = {
                             "code": resp.status_code,
                             "id": resp.status_code,
                             "status": resp.status_code,
-                            "title": resp.reason
-                        })
+                            "title": resp.reason,
+                        }
+                    raise AppleMusicAPIException(error)
                 else:
                     done = True
                     return resp
@@ -101,11 +112,25 @@ class ApiClient:
         Specific storefront for catalog requests. Auto-detects by default.
     verify_ssl: bool
         SSL verification for debug purposes.
+    max_workers: int
+        Maximum number of concurrent requests for bulk operations.
+    key_store: applemusic.KeyStore | None
+        Storage for content keys, checked before requesting a license.
+        Keeps keys in memory by default.
+    download_store: applemusic.DownloadStore | None
+        Store of downloaded songs, checked before downloading a song.
+        Songs are always downloaded if None.
 
     Attributes
     ----------
     storefront: str
         Two-letter encoded country of Apple storefront location
+    max_workers: int
+        Maximum number of concurrent requests for bulk operations.
+    key_store: applemusic.KeyStore
+        Storage for content keys.
+    download_store: applemusic.DownloadStore | None
+        Store of downloaded songs.
     session: applemusic.Session
         Wrapper for requests.Session with authentication, error and ratelimit handling.
     library: applemusic.LibraryAPI
@@ -118,6 +143,8 @@ class ApiClient:
         Account API endpoints client
     playback: applemusic.PlaybackAPI
         Playback API endpoints client
+    transfer: applemusic.TransferAPI
+        Library and playlists export and import
     """
 
     def __init__(
@@ -127,18 +154,27 @@ class ApiClient:
         widevine_device_path="device.wvd",
         storefront=None,
         verify_ssl=True,
+        max_workers=8,
+        key_store=None,
+        download_store=None,
     ) -> None:
         self.developer_token = developer_token
         self.user_token = user_token
         self.widevine_device_path = widevine_device_path
+        self.max_workers = max_workers
+        self.key_store = (
+            key_store if key_store is not None else MemoryKeyStore()
+        )
+        self.download_store = download_store
         self.session = Session(
-            self.developer_token, self.user_token, verify_ssl
+            self.developer_token, self.user_token, verify_ssl, max_workers
         )
         self.library = LibraryAPI(self)
         self.catalog = CatalogAPI(self)
         self.playlist = PlaylistAPI(self)
         self.account = AccountAPI(self)
         self.playback = PlaybackAPI(self)
+        self.transfer = TransferAPI(self)
         if self.user_token:
             if storefront is None:
                 self.storefront = self.account.subscription().storefront
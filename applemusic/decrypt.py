@@ -1,91 +1,482 @@
 # https://github.com/truedread/pymp4decrypt/blob/master/src/decrypt.py
+import contextlib
+import mmap
+import os
+import struct
+import threading
+import traceback
 from collections import deque
-from io import BufferedReader, BytesIO
+from concurrent.futures import ThreadPoolExecutor
 
 from Cryptodome.Cipher import AES
-from Cryptodome.Util import Counter
-from pymp4.parser import Box
-from pymp4.util import BoxUtil
 
+# Boxes on the way to stsd, tenc and the fragment tables
+CONTAINER_BOXES = {
+    b"moov",
+    b"trak",
+    b"mdia",
+    b"minf",
+    b"stbl",
+    b"moof",
+    b"traf",
+    b"sinf",
+    b"schi",
+}
+AUDIO_ENTRY_FIELDS = {0: 20, 1: 36, 2: 56}
+VIDEO_ENTRY_FIELDS = 70
 
-def fix_headers(box):
+
+class BoxInfo:
+    """
+    Data collected from moov and moof boxes, needed for mdat decryption.
+
+    @param sample_size: Constant sample size from stsz, 0 if samples vary
+    @param iv_size: Per-sample IV size from tenc
+    @param fragments: Sample lists of parsed track fragments, one per mdat
+    """
+
+    def __init__(self):
+        self.sample_size = 0
+        self.iv_size = 8
+        self.fragments = deque()
+
+
+def read_header(buf, pos, end=None):
+    """
+    read_header()
+
+    @param buf: Buffer with boxes
+    @param pos: Offset of box
+    @param end: End of enclosing box, end of buffer by default
+    @return: (type, header size, box end)
+    """
+    if end is None:
+        end = len(buf)
+    size, box_type = struct.unpack_from(">I4s", buf, pos)
+    header_size = 8
+    if size == 1:
+        (size,) = struct.unpack_from(">Q", buf, pos + 8)
+        header_size = 16
+    elif size == 0:
+        size = end - pos
+    return box_type, header_size, pos + size
+
+
+def build_header(box_type, payload_size):
+    """
+    build_header()
+
+    @param box_type: Four-character box type
+    @param payload_size: Size of box contents
+    @return: Box header bytes
+    """
+    if payload_size + 8 <= 0xFFFFFFFF:
+        return struct.pack(">I4s", payload_size + 8, box_type)
+    return struct.pack(">I4sQ", 1, box_type, payload_size + 16)
+
+
+def iter_boxes(buf, pos=0, end=None):
     """
-    fix_headers()
+    iter_boxes()
 
-    @param box: pymp4 Box object
+    Yields (type, start, payload start, end) of boxes in a buffer region.
     """
+    if end is None:
+        end = len(buf)
+    while pos + 8 <= end:
+        box_type, header_size, box_end = read_header(buf, pos, end)
+        yield box_type, pos, pos + header_size, box_end
+        pos = box_end
+
+
+def strip_encryption(buf, info):
+    """
+    strip_encryption()
+
+    Restores original sample entry formats and removes sinf boxes from stsd.
+    Boxes that don't contain stsd are copied as is.
+
+    @param buf: Buffer with a single moov box
+    @param info: BoxInfo to store stsz and tenc data in
+    @return: Patched moov box bytes
+    """
+    return b"".join(
+        _strip_box(buf, start, end, info)
+        for _, start, _, end in iter_boxes(buf)
+    )
+
+
+def _strip_box(buf, start, end, info):
+    box_type, header_size, _ = read_header(buf, start, end)
+    payload = start + header_size
+    if box_type in CONTAINER_BOXES:
+        children = b"".join(
+            _strip_box(buf, child_start, child_end, info)
+            for _, child_start, _, child_end in iter_boxes(buf, payload, end)
+        )
+    elif box_type == b"stsd":
+        children = bytes(buf[payload : payload + 8]) + b"".join(
+            _strip_entry(buf, entry_start, entry_end, info)
+            for _, entry_start, _, entry_end in iter_boxes(
+                buf, payload + 8, end
+            )
+        )
+    elif box_type == b"stsz":
+        (info.sample_size,) = struct.unpack_from(">I", buf, payload + 4)
+        return bytes(buf[start:end])
+    elif box_type == b"tenc":
+        info.iv_size = buf[payload + 7] or info.iv_size
+        return bytes(buf[start:end])
+    else:
+        return bytes(buf[start:end])
+    if len(children) == end - payload:
+        return bytes(buf[start:end])
+    return build_header(box_type, len(children)) + children
+
+
+def _strip_entry(buf, start, end, info):
+    entry_type, header_size, _ = read_header(buf, start, end)
+    if b"enc" not in entry_type:
+        return bytes(buf[start:end])
+    fields = start + header_size + 8
+    if entry_type == b"encv":
+        children = fields + VIDEO_ENTRY_FIELDS
+    else:
+        (version,) = struct.unpack_from(">H", buf, fields)
+        children = fields + AUDIO_ENTRY_FIELDS.get(version, 20)
     original_format = b"mp4a"
-    for stsd_box in BoxUtil.find(box, b"stsd"):
-        for entry in stsd_box.entries:
-            if b"enc" in entry.format:
-                entry.format = original_format
-    return
+    kept = []
+    for box_type, child_start, child_payload, child_end in iter_boxes(
+        buf, children, end
+    ):
+        if box_type != b"sinf":
+            kept.append(bytes(buf[child_start:child_end]))
+            continue
+        for sinf_type, _, sinf_payload, _ in iter_boxes(
+            buf, child_payload, child_end
+        ):
+            if sinf_type == b"frma":
+                original_format = bytes(buf[sinf_payload : sinf_payload + 4])
+        _strip_box(buf, child_start, child_end, info)
+    payload = bytes(buf[start + header_size : children]) + b"".join(kept)
+    return build_header(original_format, len(payload)) + payload
+
+
+def read_fragments(buf, info):
+    """
+    read_fragments()
 
+    Collects (iv, size, subsamples) sample lists of every track fragment.
 
-def decrypt(key, inp, out):
+    @param buf: Buffer with a single moof box
+    @param info: BoxInfo to store sample lists in
+    """
+    for _, _, moof_payload, moof_end in iter_boxes(buf):
+        for traf_type, _, traf_payload, traf_end in iter_boxes(
+            buf, moof_payload, moof_end
+        ):
+            if traf_type == b"traf":
+                info.fragments.append(
+                    _read_traf(buf, traf_payload, traf_end, info)
+                )
+
+
+def _read_traf(buf, pos, end, info):
+    default_size = 0
+    sizes = []
+    ivs = []
+    for box_type, _, payload, _ in iter_boxes(buf, pos, end):
+        if box_type not in (b"tfhd", b"trun", b"senc"):
+            continue
+        (flags,) = struct.unpack_from(">I", buf, payload)
+        flags &= 0xFFFFFF
+        if box_type == b"tfhd":
+            offset = payload + 8
+            offset += 8 if flags & 0x1 else 0
+            offset += 4 if flags & 0x2 else 0
+            offset += 4 if flags & 0x8 else 0
+            if flags & 0x10:
+                (default_size,) = struct.unpack_from(">I", buf, offset)
+        elif box_type == b"trun":
+            (count,) = struct.unpack_from(">I", buf, payload + 4)
+            offset = payload + 8
+            offset += 4 if flags & 0x1 else 0
+            offset += 4 if flags & 0x4 else 0
+            offset += 4 if flags & 0x100 else 0
+            step = 4 * bin(flags & 0xF00).count("1")
+            for i in range(count):
+                if flags & 0x200:
+                    sizes.append(
+                        struct.unpack_from(">I", buf, offset + i * step)[0]
+                    )
+                else:
+                    sizes.append(None)
+        elif box_type == b"senc":
+            (count,) = struct.unpack_from(">I", buf, payload + 4)
+            offset = payload + 8
+            for _ in range(count):
+                iv = bytes(buf[offset : offset + info.iv_size])
+                offset += info.iv_size
+                subsamples = None
+                if flags & 0x2:
+                    (subsample_count,) = struct.unpack_from(">H", buf, offset)
+                    offset += 2
+                    subsamples = [
+                        struct.unpack_from(">HI", buf, offset + 6 * i)
+                        for i in range(subsample_count)
+                    ]
+                    offset += 6 * subsample_count
+                ivs.append((iv, subsamples))
+    samples = []
+    for (iv, subsamples), size in zip(ivs, sizes):
+        if info.sample_size:
+            samples.append((iv, info.sample_size, None))
+        elif not subsamples:
+            samples.append((iv, size or default_size, None))
+        else:
+            samples.append((iv, None, subsamples))
+    return samples
+
+
+def decrypt_samples(key, src, dst, samples):
+    """
+    decrypt_samples()
+
+    @param key: AES-128 CENC key in bytes
+    @param src: Buffer with encrypted samples
+    @param dst: Writable buffer of the same size for decrypted samples
+    @param samples: Iterable of (iv, size, subsamples) tuples, where subsamples
+        is either None or a list of (clear_bytes, cipher_bytes) pairs
+    @return: Amount of processed bytes
+    """
+    src = memoryview(src)
+    dst = memoryview(dst)
+    pos = 0
+    for iv, size, subsamples in samples:
+        cipher = AES.new(key, AES.MODE_CTR, nonce=iv, initial_value=0)
+        if not subsamples:
+            end = min(pos + size, len(src))
+            cipher.decrypt(src[pos:end], output=dst[pos:end])
+            pos = end
+            continue
+        for clear_bytes, cipher_bytes in subsamples:
+            end = min(pos + clear_bytes, len(src))
+            dst[pos:end] = src[pos:end]
+            pos = end
+            end = min(pos + cipher_bytes, len(src))
+            cipher.decrypt(src[pos:end], output=dst[pos:end])
+            pos = end
+    return pos
+
+
+def _decrypt_data(key, data, samples):
+    clear_data = bytearray(len(data))
+    size = decrypt_samples(key, data, clear_data, samples)
+    if size < len(clear_data):
+        del clear_data[size:]
+    return build_header(b"mdat", len(clear_data)) + clear_data
+
+
+def decrypt(key, inp, out, workers=0, max_in_flight=None):
     """
     decrypt()
 
     @param key: AES-128 CENC key in bytes
     @param inp: Open input file
     @param out: Open output file
+    @param workers: Amount of threads decrypting fragments in parallel,
+        fragments are decrypted serially if 0
+    @param max_in_flight: Maximum amount of boxes waiting to be written,
+        twice the amount of workers by default
     """
+    if not workers:
+        for data, samples in _iter_top_boxes(inp):
+            if samples is not None:
+                data = _decrypt_data(key, data, samples)
+            out.write(data)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+    pending = deque()
 
-    with BufferedReader(inp) as reader:
-        senc_boxes = deque()
-        trun_boxes = deque()
-        boxes = []
-        while reader.peek(1):
-            box = Box.parse_stream(reader)
-            fix_headers(box)
-
-            for stsd_box in BoxUtil.find(box, b"stsz"):
-                sample_size = stsd_box.sample_size
-
-            for stsd_box in BoxUtil.find(box, b"stsd"):
-                newbox = stsd_box.entries[0]
-                for b in newbox.children:
-                    if b.type == b"sinf":
-                        newbox.children.remove(b)
-
-            if box.type == b"moof":
-                senc_boxes.extend(BoxUtil.find(box, b"senc"))
-                trun_boxes.extend(BoxUtil.find(box, b"trun"))
-            elif box.type == b"mdat":
-                senc_box = senc_boxes.popleft()
-                trun_box = trun_boxes.popleft()
-
-                clear_box = b""
-
-                with BytesIO(box.data) as box_bytes:
-                    for sample, sample_info in zip(
-                        senc_box.sample_encryption_info, trun_box.sample_info
-                    ):
-                        counter = Counter.new(
-                            64, prefix=sample.iv, initial_value=0
-                        )
-
-                        cipher = AES.new(key, AES.MODE_CTR, counter=counter)
-
-                        if sample_size:
-                            cipher_bytes = box_bytes.read(sample_size)
-                            clear_box += cipher.decrypt(cipher_bytes)
-                        elif not sample.subsample_encryption_info:
-                            cipher_bytes = box_bytes.read(
-                                sample_info.sample_size
-                            )
-                            clear_box += cipher.decrypt(cipher_bytes)
-                        else:
-                            for subsample in sample.subsample_encryption_info:
-                                clear_box += box_bytes.read(
-                                    subsample.clear_bytes
-                                )
-                                cipher_bytes = box_bytes.read(
-                                    subsample.cipher_bytes
-                                )
-                                clear_box += cipher.decrypt(cipher_bytes)
-                box.data = clear_box
-            boxes.append(box)
-    for b in boxes:
-        out.write(Box.build(b))
+    def write(data, future):
+        out.write(data if future is None else future.result())
+
+    with ThreadPoolExecutor(workers) as executor:
+        for data, samples in _iter_top_boxes(inp):
+            future = None
+            if samples is not None:
+                future = executor.submit(_decrypt_data, key, data, samples)
+            pending.append((data, future))
+            while pending and (
+                len(pending) > max_in_flight
+                or pending[0][1] is None
+                or pending[0][1].done()
+            ):
+                write(*pending.popleft())
+        while pending:
+            write(*pending.popleft())
     return
+
+
+def decrypt_file(key, in_path, out_path, workers=0, max_in_flight=None):
+    """
+    decrypt_file()
+
+    Decrypts a file on disk through memory maps. The output file is
+    preallocated and samples are decrypted straight from the input map into
+    the output map, so no box is copied into Python memory except moov and
+    moof.
+
+    @param key: AES-128 CENC key in bytes
+    @param in_path: Path of encrypted input file
+    @param out_path: Path of output file. Written to a temporary file next to
+        it first and replaced on success, so it may be in_path as well
+    @param workers: Amount of threads decrypting fragments in parallel,
+        fragments are decrypted serially if 0
+    @param max_in_flight: Maximum amount of fragments being decrypted,
+        twice the amount of workers by default
+    @return: Size of decrypted file
+    """
+    tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(in_path, "rb") as inp, open(tmp_path, "w+b") as out:
+            total = _decrypt_mapped(key, inp, out, workers, max_in_flight)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    return total
+
+
+def _decrypt_mapped(key, inp, out, workers, max_in_flight):
+    if not os.fstat(inp.fileno()).st_size:
+        return 0
+    with mmap.mmap(inp.fileno(), 0, access=mmap.ACCESS_READ) as src:
+        info = BoxInfo()
+        layout = list(_plan_boxes(src, info))
+        total = sum(len(header) for _, header, _, _ in layout)
+        total += sum(size for _, _, _, size in layout)
+        out.truncate(total)
+        if not total:
+            return 0
+        with mmap.mmap(out.fileno(), total) as dst:
+            src_view = memoryview(src)
+            dst_view = memoryview(dst)
+            try:
+                _decrypt_layout(
+                    key,
+                    src_view,
+                    dst_view,
+                    layout,
+                    info,
+                    workers,
+                    max_in_flight or workers * 2,
+                )
+            except BaseException as e:
+                # Slices of both maps held by the traceback would keep them
+                # from closing and hide the error
+                traceback.clear_frames(e.__traceback__)
+                raise
+            finally:
+                src_view.release()
+                dst_view.release()
+            dst.flush()
+    return total
+
+
+def _plan_boxes(src, info):
+    """Yields (type, header, payload start, payload size) of every top-level
+    box of the output file. Output header is the complete box for moov, which
+    is the only box that changes in size apart from trimmed mdat payloads.
+    """
+    for box_type, start, payload, end in iter_boxes(src):
+        end = min(end, len(src))
+        if box_type == b"moov":
+            yield box_type, strip_encryption(src[start:end], info), end, 0
+            continue
+        if box_type == b"moof":
+            read_fragments(src[start:end], info)
+        elif box_type == b"mdat" and info.fragments:
+            size = min(_samples_size(info.fragments.popleft()), end - payload)
+            yield box_type, build_header(box_type, size), payload, size
+            continue
+        yield box_type, b"", start, end - start
+
+
+def _samples_size(samples):
+    return sum(
+        size if not subsamples else sum(map(sum, subsamples))
+        for _, size, subsamples in samples
+    )
+
+
+def _decrypt_layout(key, src, dst, layout, info, workers, max_in_flight):
+    pending = deque()
+    executor = ThreadPoolExecutor(workers) if workers else None
+    pos = 0
+    try:
+        for box_type, header, start, size in layout:
+            dst[pos : pos + len(header)] = header
+            pos += len(header)
+            if box_type == b"moof":
+                read_fragments(src[start : start + size], info)
+            if box_type != b"mdat" or not header:
+                dst[pos : pos + size] = src[start : start + size]
+            else:
+                args = (
+                    key,
+                    src[start : start + size],
+                    dst[pos : pos + size],
+                    info.fragments.popleft(),
+                )
+                if executor is None:
+                    decrypt_samples(*args)
+                else:
+                    pending.append(executor.submit(decrypt_samples, *args))
+                    while len(pending) > max_in_flight:
+                        pending.popleft().result()
+            pos += size
+        while pending:
+            pending.popleft().result()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _read_exact(inp, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = inp.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _iter_top_boxes(inp):
+    """Yields top-level boxes read from a stream. mdat boxes are yielded as
+    payload with their (iv, size, subsamples) sample list, other boxes as
+    complete bytes to write with None.
+    """
+    info = BoxInfo()
+    while header := _read_exact(inp, 8):
+        size, box_type = struct.unpack(">I4s", header)
+        if size == 1:
+            header += _read_exact(inp, 8)
+            (size,) = struct.unpack_from(">Q", header, 8)
+        if size == 0:
+            payload = bytearray(inp.read())
+        else:
+            payload = _read_exact(inp, size - len(header))
+        if box_type == b"mdat" and info.fragments:
+            yield payload, info.fragments.popleft()
+            continue
+        data = header + payload
+        if box_type == b"moov":
+            data = strip_encryption(data, info)
+        elif box_type == b"moof":
+            read_fragments(data, info)
+        yield data, None
@@ -0,0 +1,420 @@
+from __future__ import annotations
+
+import io
+import itertools
+import logging
+import math
+import os
+import queue
+import shutil
+import threading
+import time
+from enum import Enum
+from typing import TYPE_CHECKING, Callable
+
+import m3u8
+from pydantic import BaseModel
+
+from applemusic.api.playback import TrackTags
+from applemusic.decrypt import decrypt
+from applemusic.models.song import LibrarySong, Song
+
+if TYPE_CHECKING:
+    from applemusic.client import ApiClient
+
+_log = logging.getLogger(__name__)
+
+
+class DownloadStage(Enum):
+    """Stages every download goes through, in order."""
+
+    Metadata = "metadata"
+    Webplayback = "webplayback"
+    License = "license"
+    Segments = "segments"
+    Decrypt = "decrypt"
+    Tag = "tag"
+    Write = "write"
+
+
+class DownloadStatus(Enum):
+    """State of a download job."""
+
+    Pending = "pending"
+    Running = "running"
+    Done = "done"
+    Failed = "failed"
+    Cancelled = "cancelled"
+
+
+class DownloadProgress(BaseModel):
+    """Snapshot passed to the progress callback.
+
+    Attributes
+    ----------
+    song_id: `str`
+        ID of the song the update is about.
+    stage: `DownloadStage`
+        Last stage the song finished or failed in.
+    status: `DownloadStatus`
+        State of the song's job.
+    done: `int`
+        Amount of finished downloads.
+    failed: `int`
+        Amount of failed downloads.
+    cancelled: `int`
+        Amount of cancelled downloads.
+    total: `int`
+        Amount of submitted downloads.
+    downloaded_bytes: `int`
+        Amount of downloaded encrypted audio.
+    bytes_per_second: `float`
+        Average download throughput since start.
+    """
+
+    song_id: str
+    stage: DownloadStage
+    status: DownloadStatus
+    done: int
+    failed: int
+    cancelled: int
+    total: int
+    downloaded_bytes: int
+    bytes_per_second: float
+
+
+class DownloadJob:
+    """Download of a single song, created by `DownloadManager.submit`.
+
+    Attributes
+    ----------
+    song: `Song`|`LibrarySong`
+        Song to download.
+    target: `str`
+        Output file path.
+    priority: `int`
+        Jobs with higher priority are taken first by every stage.
+    status: `DownloadStatus`
+        State of the job.
+    stage: `DownloadStage`
+        Stage the job is in, or finished in.
+    tags: `TrackTags`|`None`
+        Tag inputs, fetched in metadata stage.
+    error: `Exception`|`None`
+        Error the job failed with.
+    """
+
+    def __init__(
+        self,
+        song: Song | LibrarySong,
+        target: str,
+        priority: int,
+        tags: TrackTags | None = None,
+    ) -> None:
+        self.song = song
+        self.target = target
+        self.priority = priority
+        self.tags = tags
+        self.status = DownloadStatus.Pending
+        self.stage = DownloadStage.Metadata
+        self.error: Exception | None = None
+        self.catalog_song: Song | None = None
+        self.stored = False
+        self.selection: str | None = None
+        self.flavor: str | None = None
+        self.url: str | None = None
+        self.playlist: m3u8.M3U8 | None = None
+        self.key: bytes | None = None
+        self.data: bytes | io.BytesIO | None = None
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """Cancels the job. Stage in progress is finished, next ones are skipped."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """`bool`: Whether the job was cancelled."""
+        return self._cancelled.is_set()
+
+
+class DownloadManager:
+    """Downloads many songs at once, running every stage in its own worker pool.
+
+    Stages are connected by bounded priority queues, so network-bound and
+    CPU-bound stages overlap while a limited amount of songs is held in memory.
+
+    Arguments
+    ---------
+    client: `ApiClient`
+        Client to download with.
+    workers: Dict[`DownloadStage`, `int`]|`None`
+        Worker count per stage, overrides defaults. Segments workers download
+        one song each and share `max_workers` concurrent segment requests of
+        the client.
+    queue_size: `int`
+        Maximum amount of songs waiting between two stages.
+    retries: `int`
+        Retries of a failed stage per song.
+    retry_delay: `float`
+        Seconds between retries, doubled every attempt.
+    progress: Callable[[`DownloadProgress`], `None`]|`None`
+        Called from worker threads after every stage of every song.
+    """
+
+    def __init__(
+        self,
+        client: ApiClient,
+        workers: dict[DownloadStage, int] | None = None,
+        queue_size: int = 16,
+        retries: int = 2,
+        retry_delay: float = 1.0,
+        progress: Callable[[DownloadProgress], None] | None = None,
+    ) -> None:
+        self.client = client
+        self.workers = {
+            DownloadStage.Metadata: 4,
+            DownloadStage.Webplayback: 4,
+            DownloadStage.License: 2,
+            DownloadStage.Segments: 2,
+            DownloadStage.Decrypt: os.cpu_count() or 1,
+            DownloadStage.Tag: 2,
+            DownloadStage.Write: 2,
+        }
+        self.workers.update(workers or {})
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.progress = progress
+        self.jobs: list[DownloadJob] = []
+        stages = list(DownloadStage)
+        self._next = dict(zip(stages, stages[1:]))
+        # Submitted songs wait unbounded, queues between stages are bounded
+        self._queues: dict[
+            DownloadStage,
+            queue.PriorityQueue[tuple[float, int, DownloadJob | None]],
+        ] = {
+            stage: queue.PriorityQueue(0 if i == 0 else queue_size)
+            for i, stage in enumerate(stages)
+        }
+        self._order = itertools.count()
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Condition()
+        self._remaining = 0
+        self._counts = {status: 0 for status in DownloadStatus}
+        self._downloaded_bytes = 0
+        self._started_at: float | None = None
+
+    def submit(
+        self,
+        song: Song | LibrarySong,
+        target: str,
+        priority: int = 0,
+        tags: TrackTags | None = None,
+    ) -> DownloadJob:
+        """`DownloadJob`: Queues song for download.
+
+        Arguments
+        ---------
+        song: `Song`|`LibrarySong`
+            Song to download. Library songs are downloaded as their catalog
+            counterpart.
+        target: `str`
+            Output file path.
+        priority: `int`
+            Jobs with higher priority are taken first by every stage.
+        tags: `TrackTags`|`None`
+            Already known tag inputs, missing ones are fetched.
+        """
+        job = DownloadJob(song, target, priority, tags)
+        with self._lock:
+            self.jobs.append(job)
+            self._remaining += 1
+        self._put(DownloadStage.Metadata, job)
+        return job
+
+    def start(self) -> None:
+        """Starts worker threads. Songs can be submitted before and after."""
+        if self._threads:
+            return
+        self._started_at = time.monotonic()
+        for stage in DownloadStage:
+            for i in range(self.workers[stage]):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage,),
+                    name=f"download-{stage.value}-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def join(self) -> list[DownloadJob]:
+        """List[`DownloadJob`]: Waits for all submitted songs, stops workers and
+        returns all jobs.
+        """
+        self.start()
+        with self._lock:
+            self._lock.wait_for(lambda: self._remaining == 0)
+        for stage in DownloadStage:
+            for _ in range(self.workers[stage]):
+                self._queues[stage].put((math.inf, next(self._order), None))
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        return self.jobs
+
+    def cancel(self) -> None:
+        """Cancels all submitted jobs."""
+        with self._lock:
+            jobs = list(self.jobs)
+        for job in jobs:
+            job.cancel()
+
+    def _put(self, stage: DownloadStage, job: DownloadJob) -> None:
+        self._queues[stage].put((-job.priority, next(self._order), job))
+
+    def _work(self, stage: DownloadStage) -> None:
+        inbox = self._queues[stage]
+        while True:
+            _, _, job = inbox.get()
+            if job is None:
+                return
+            if job.cancelled:
+                self._finish(job, DownloadStatus.Cancelled)
+                continue
+            job.stage = stage
+            job.status = DownloadStatus.Running
+            for attempt in range(self.retries + 1):
+                try:
+                    self._run_stage(stage, job)
+                    break
+                except Exception as e:
+                    job.error = e
+                    if attempt == self.retries or job.cancelled:
+                        break
+                    _log.info(
+                        "%s of %s failed, retrying: %s",
+                        stage.value,
+                        job.song.id,
+                        e,
+                    )
+                    # Cancelling the job ends the wait early
+                    if job._cancelled.wait(self.retry_delay * 2**attempt):
+                        break
+            if job.error is not None and job.cancelled:
+                self._finish(job, DownloadStatus.Cancelled)
+            elif job.error is not None:
+                _log.warning(
+                    "%s of %s failed: %s", stage.value, job.song.id, job.error
+                )
+                self._finish(job, DownloadStatus.Failed)
+            elif job.stored and stage == DownloadStage.Metadata:
+                # Stored songs skip all requests and go straight to tagging
+                self._report(job)
+                self._put(DownloadStage.Tag, job)
+            elif (next_stage := self._next.get(stage)) is None:
+                self._finish(job, DownloadStatus.Done)
+            else:
+                self._report(job)
+                self._put(next_stage, job)
+
+    def _run_stage(self, stage: DownloadStage, job: DownloadJob) -> None:
+        playback = self.client.playback
+        job.error = None
+        match stage:
+            case DownloadStage.Metadata:
+                if isinstance(job.song, LibrarySong):
+                    job.catalog_song = job.song.get_catalog_song()
+                    if job.catalog_song is None:
+                        raise ValueError(f"{job.song.id} is not in catalog")
+                else:
+                    job.catalog_song = job.song
+                job.tags = playback.fetch_tags(job.catalog_song, job.tags)
+                job.selection = playback.flavor_selection()
+                store = playback.download_store
+                if (
+                    store is not None
+                    and (
+                        stored := store.lookup(job.catalog_song, job.selection)
+                    )
+                    is not None
+                ):
+                    job.data = io.BytesIO()
+                    with open(stored, "rb") as f:
+                        shutil.copyfileobj(f, job.data)
+                    job.stored = True
+            case DownloadStage.Webplayback:
+                assert job.catalog_song is not None
+                job.flavor, job.url = playback.select_flavor(job.catalog_song)
+            case DownloadStage.License:
+                assert job.catalog_song is not None and job.url is not None
+                job.playlist = playback.get_media_playlist(job.url)
+                job.key = playback.get_decryption_key(
+                    job.url, job.catalog_song.play_params.id, job.playlist
+                )
+            case DownloadStage.Segments:
+                assert job.playlist is not None and job.url is not None
+                # Split so all songs in this stage stay within the client's
+                # connection pool
+                budget = self.client.max_workers // self.workers[stage]
+                job.data = playback.download_segments(
+                    playback.get_segment_ranges(job.playlist, job.url),
+                    max(1, budget),
+                )
+                with self._lock:
+                    self._downloaded_bytes += len(job.data)
+            case DownloadStage.Decrypt:
+                assert isinstance(job.data, bytes) and job.key is not None
+                out_buf = io.BytesIO()
+                decrypt(job.key, io.BytesIO(job.data), out_buf)
+                if (store := playback.download_store) is not None:
+                    with out_buf.getbuffer() as data:
+                        store.add_bytes(
+                            job.catalog_song, job.selection, job.flavor, data
+                        )
+                # Kept as buffer so tags are written into it in place
+                job.data = out_buf
+            case DownloadStage.Tag:
+                assert job.catalog_song is not None and job.data is not None
+                job.data = playback.apply_tags(
+                    job.catalog_song, job.data, job.tags
+                )
+            case DownloadStage.Write:
+                assert job.data is not None
+                assert not isinstance(job.data, io.BytesIO)
+                with open(job.target + ".tmp", "wb") as f:
+                    f.write(job.data)
+                os.replace(job.target + ".tmp", job.target)
+                job.data = None
+
+    def _finish(self, job: DownloadJob, status: DownloadStatus) -> None:
+        job.status = status
+        job.data = None
+        with self._lock:
+            self._counts[status] += 1
+            self._remaining -= 1
+            self._lock.notify_all()
+        self._report(job)
+
+    def _report(self, job: DownloadJob) -> None:
+        if self.progress is None:
+            return
+        with self._lock:
+            elapsed = time.monotonic() - (self._started_at or time.monotonic())
+            progress = DownloadProgress(
+                song_id=job.song.id,
+                stage=job.stage,
+                status=job.status,
+                done=self._counts[DownloadStatus.Done],
+                failed=self._counts[DownloadStatus.Failed],
+                cancelled=self._counts[DownloadStatus.Cancelled],
+                total=len(self.jobs),
+                downloaded_bytes=self._downloaded_bytes,
+                bytes_per_second=(
+                    self._downloaded_bytes / elapsed if elapsed else 0.0
+                ),
+            )
+        try:
+            self.progress(progress)
+        except Exception:
+            _log.exception("progress callback failed")
@@ -0,0 +1,153 @@
+import hashlib
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+
+from Cryptodome.Cipher import AES
+
+_log = logging.getLogger(__name__)
+
+
+class KeyStore(ABC):
+    """Base class for content key storage.
+
+    Keys are looked up by KID, the base64 key ID from the `EXT-X-KEY` URI of
+    a media playlist. Subclass and implement `get` and `put` to plug in
+    another backend.
+    """
+
+    @abstractmethod
+    def get(self, kid: str) -> bytes | None:
+        """`bytes`|`None`: Returns stored content key or `None` if unknown.
+
+        Arguments
+        ---------
+        kid: `str`
+            Base64 encoded key ID.
+        """
+
+    @abstractmethod
+    def put(self, kid: str, key: bytes) -> None:
+        """Stores content key.
+
+        Arguments
+        ---------
+        kid: `str`
+            Base64 encoded key ID.
+        key: `bytes`
+            Content key.
+        """
+
+
+class MemoryKeyStore(KeyStore):
+    """Keeps content keys in memory for lifetime of the process."""
+
+    def __init__(self) -> None:
+        self._keys: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def get(self, kid: str) -> bytes | None:
+        with self._lock:
+            return self._keys.get(kid)
+
+    def put(self, kid: str, key: bytes) -> None:
+        with self._lock:
+            self._keys[kid] = key
+
+
+class FileKeyStore(KeyStore):
+    """Keeps content keys in a directory, encrypted with a secret.
+
+    Every key is stored in its own file, sealed with AES-GCM under a key
+    derived from the secret with scrypt. KID is authenticated as well, so a
+    file can't be swapped for another key.
+
+    Arguments
+    ---------
+    path: `str`
+        Directory for key files. Created if missing.
+    secret: `str`|`bytes`
+        Secret to derive the storage key from.
+    """
+
+    def __init__(self, path: str | os.PathLike, secret: str | bytes) -> None:
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        if isinstance(secret, str):
+            secret = secret.encode()
+        self._storage_key = hashlib.scrypt(
+            secret, salt=self._salt(), n=2**14, r=8, p=1, dklen=32
+        )
+
+    def _salt(self) -> bytes:
+        salt_path = os.path.join(self.path, "salt")
+        if not os.path.exists(salt_path):
+            tmp_path = f"{salt_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(os.urandom(16))
+            try:
+                # Linking fails if another process created the salt first
+                os.link(tmp_path, salt_path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+        with open(salt_path, "rb") as f:
+            return f.read()
+
+    def _key_path(self, kid: str) -> str:
+        name = hashlib.sha256(kid.encode()).hexdigest()
+        return os.path.join(self.path, f"{name}.key")
+
+    def get(self, kid: str) -> bytes | None:
+        try:
+            with open(self._key_path(kid), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        cipher = AES.new(self._storage_key, AES.MODE_GCM, nonce=data[:12])
+        cipher.update(kid.encode())
+        try:
+            return cipher.decrypt_and_verify(data[28:], data[12:28])
+        except ValueError:
+            _log.warning("stored key for %s failed verification", kid)
+            return None
+
+    def put(self, kid: str, key: bytes) -> None:
+        cipher = AES.new(self._storage_key, AES.MODE_GCM, nonce=os.urandom(12))
+        cipher.update(kid.encode())
+        encrypted, tag = cipher.encrypt_and_digest(key)
+        path = self._key_path(kid)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(bytes(cipher.nonce) + tag + encrypted)
+        os.replace(tmp_path, path)
+
+
+class TieredKeyStore(KeyStore):
+    """Looks keys up in several stores, fastest first.
+
+    Keys found in a slower tier are copied to all faster ones, new keys are
+    stored in every tier.
+
+    Arguments
+    ---------
+    tiers: `KeyStore`
+        Stores ordered from fastest to slowest.
+    """
+
+    def __init__(self, *tiers: KeyStore) -> None:
+        self.tiers = tiers
+
+    def get(self, kid: str) -> bytes | None:
+        for i, tier in enumerate(self.tiers):
+            if (key := tier.get(kid)) is not None:
+                for faster in self.tiers[:i]:
+                    faster.put(kid, key)
+                return key
+        return None
+
+    def put(self, kid: str, key: bytes) -> None:
+        for tier in self.tiers:
+            tier.put(kid, key)
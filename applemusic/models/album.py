@@ -181,6 +181,23 @@ class Album(AppleMusicObject):
     def __repr__(self) -> str:
         return f"<{self.__str__()} ({self.id})>"
 
+    def download(self, dest: str, workers: int = 4) -> list[str]:
+        """List[`str`]: Downloads all songs of album to a directory, returns
+        written file paths.
+
+        Needs a Music User Token.
+
+        Needs a Widevine device file.
+
+        Arguments
+        ---------
+        dest: `str`
+            Output directory. Created if missing.
+        workers: `int`
+            Amount of songs downloaded at once.
+        """
+        return self._client.playback.download_album(self, dest, workers)
+
     def artist(self) -> list[Artist]:
         """`Artist`: Returns artists performing the album."""
         artists = []
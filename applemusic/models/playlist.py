@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from enum import Enum
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Sequence
 
 from pydantic import BaseModel, Field
 
@@ -30,6 +30,31 @@ class PlaylistType(Enum):
     UserShared = "user-shared"
 
 
+class PlaylistSyncResult(BaseModel):
+    """Changes made by playlist synchronization.
+
+    Attributes
+    ----------
+    added: list[`AppleMusicObject`]
+        Songs added to playlist.
+    removed: list[`AppleMusicObject`]
+        Songs removed from playlist.
+    not_removable: list[`AppleMusicObject`]
+        Catalog tracks that are not in target but can't be removed, only
+        library songs can be removed from a playlist.
+    kept: `int`
+        Amount of tracks that were already in place.
+    success: `bool`
+        If all requests succeeded.
+    """
+
+    added: Sequence[AppleMusicObject] = []
+    removed: Sequence[AppleMusicObject] = []
+    not_removable: Sequence[AppleMusicObject] = []
+    kept: int = 0
+    success: bool = True
+
+
 class PlaylistAttributes(BaseModel):
     """Class that represents data about playlist.
     Not meant to be used directly.
@@ -151,7 +176,7 @@ class Playlist(AppleMusicObject):
     def has_song(self, song: Song) -> bool:
         """`bool`: If playlist has specific song.
 
-        Could be slow.
+        Could be slow on the first call, track IDs are cached afterwards.
 
         Arguments
         ---------
@@ -174,6 +199,9 @@ class LibraryPlaylistAttributes(BaseModel):
     has_catalog: bool = Field(alias="hasCatalog")
     has_collaboration: bool = Field(alias="hasCollaboration", default=False)
     is_public: bool = Field(alias="isPublic")
+    last_modified_date: str = Field(
+        alias="lastModifiedDate", default="1970-01-01"
+    )
     name: str
     play_params: PlayParameters = Field(
         alias="playParams", default=PlayParameters(**{})
@@ -210,6 +238,8 @@ class LibraryPlaylist(AppleMusicObject):
         If playlist is collaborative work.
     is_public: `bool`
         If playlist is public.
+    last_modified_date: `str`
+        Playlist edit date.
     name: `str`
         Playlist name.
     play_params: `PlayParameters`
@@ -252,6 +282,10 @@ class LibraryPlaylist(AppleMusicObject):
     def is_public(self) -> bool:
         return self.attributes.is_public
 
+    @property
+    def last_modified_date(self) -> str:
+        return self.attributes.last_modified_date
+
     @property
     def name(self) -> str:
         return self.attributes.name
@@ -286,17 +320,17 @@ class LibraryPlaylist(AppleMusicObject):
         """list[`LibrarySong`]: Returns a list of playlist songs."""
         return self._client.playlist.list_tracks(self)
 
-    def remove_songs(self, song: LibrarySong) -> bool:
-        """`bool`: Removes song from playlist.
+    def remove_songs(self, songs: LibrarySong | list[LibrarySong]) -> bool:
+        """`bool`: Removes songs from playlist.
 
         Needs Music User Token.
 
         Arguments
         ---------
-        song: `LibrarySong`
-            A song to be removed.
+        songs: `LibrarySong`|list[`LibrarySong`]
+            A song or a list of songs to be removed.
         """
-        return self._client.playlist.delete_from_playlist(self, song)
+        return self._client.playlist.delete_from_playlist(self, songs)
 
     def delete(self) -> bool:
         """`bool`: Deletes the playlist.
@@ -305,10 +339,26 @@ class LibraryPlaylist(AppleMusicObject):
         """
         return self._client.playlist.delete_playlist(self)
 
+    def sync(
+        self, songs: list[LibrarySong | Song], dry_run: bool = False
+    ) -> PlaylistSyncResult:
+        """`PlaylistSyncResult`: Makes playlist contain exactly given songs.
+
+        Needs Music User Token.
+
+        Arguments
+        ---------
+        songs: list[`LibrarySong`|`Song`]
+            Desired playlist contents.
+        dry_run: `bool`
+            Only compute the changes.
+        """
+        return self._client.playlist.sync(self, songs, dry_run)
+
     def has_song(self, song: LibrarySong) -> bool:
         """`bool`: If playlist has specific song.
 
-        Could be slow.
+        Could be slow on the first call, track IDs are cached afterwards.
 
         Arguments
         ---------
@@ -45,7 +45,10 @@ class Relationships(BaseModel):
         Albums relationships.
     artists: `RelationshipArray`
         Artists relationships.
+    catalog: `RelationshipArray`
+        Library only. Corresponding catalog object.
     """
 
     albums: RelationshipArray = RelationshipArray(**{})
     artists: RelationshipArray = RelationshipArray(**{})
+    catalog: RelationshipArray = RelationshipArray(**{})
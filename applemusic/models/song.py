@@ -272,11 +272,18 @@ class Song(AppleMusicObject):
         return self._client.library.add(self)
 
     def album(self) -> Album:
-        """`Album`: Returns album containing the song."""
-        song = self._client.catalog.get_by_id(self.id, CatalogTypes.Songs)
-        assert song is not None
+        """`Album`: Returns album containing the song.
+
+        Uses album relationship of the song if present, otherwise fetches the
+        song first.
+        """
+        albums = self.relationships.albums.data
+        if not albums:
+            song = self._client.catalog.get_by_id(self.id, CatalogTypes.Songs)
+            assert song is not None
+            albums = song.relationships.albums.data
         album = self._client.catalog.get_by_id(
-            song.relationships.albums.data[0].id, CatalogTypes.Albums
+            albums[0].id, CatalogTypes.Albums
         )
         assert isinstance(album, Album)
         return album
@@ -396,6 +403,15 @@ class LibrarySong(AppleMusicObject):
     """
 
     attributes: LibrarySongAttributes
+    _catalog_song: Song | None = None
+
+    def __init__(self, client, **data):
+        super().__init__(client, **data)
+        catalog = data.get("relationships", {}).get("catalog", {})
+        for res in catalog.get("data", []):
+            if "attributes" in res:
+                self._catalog_song = Song(client, **res)
+                break
 
     @property
     def album_name(self) -> str:
@@ -463,8 +479,16 @@ class LibrarySong(AppleMusicObject):
         return None
 
     def get_catalog_song(self) -> Song | None:
-        """`Song`|`None`: Returns corresponding catalog song, `None` if not exists."""
-        return self._client.catalog.get_corresponding_catalog_song(self)
+        """`Song`|`None`: Returns corresponding catalog song, `None` if not exists.
+
+        Uses the catalog song included with the library song if it was requested,
+        otherwise fetches it once and reuses the result.
+        """
+        if self._catalog_song is None:
+            self._catalog_song = (
+                self._client.catalog.get_corresponding_catalog_song(self)
+            )
+        return self._catalog_song
 
     def lyrics(self) -> Lyrics | None:
         """`Lyrics`|`None`: Returns lyrics for song, `None` if not exists."""
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import stat
+import threading
+import time
+from typing import TYPE_CHECKING
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore[assignment]
+
+if TYPE_CHECKING:
+    from applemusic.models.song import Song
+
+_log = logging.getLogger(__name__)
+
+# ioctl request cloning a whole file on Linux (btrfs, xfs, bcachefs)
+FICLONE = 0x40049409
+
+
+class DownloadStore:
+    """Content store of decrypted, untagged downloads.
+
+    Songs are indexed by catalog ID and ISRC together with the flavor
+    selection they were downloaded with, so one recording reached through
+    different albums or playlists is stored and downloaded once. Files are
+    kept by their SHA-256 hash, which is checked before a stored file is
+    reused.
+
+    Arguments
+    ---------
+    path: `str`
+        Store directory. Created if missing.
+    verify: `bool`
+        Check hashes of stored files on every lookup.
+    """
+
+    def __init__(self, path: str | os.PathLike, verify: bool = True) -> None:
+        self.path = path
+        self.verify = verify
+        os.makedirs(os.path.join(self.path, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(self.path, "index.sqlite"), check_same_thread=False
+        )
+        with self._lock, self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    catalog_id TEXT NOT NULL,
+                    isrc TEXT NOT NULL,
+                    selection TEXT NOT NULL,
+                    flavor TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    added REAL NOT NULL,
+                    PRIMARY KEY (catalog_id, selection)
+                )
+            """)
+            self._db.execute("""
+                CREATE INDEX IF NOT EXISTS downloads_isrc
+                ON downloads (isrc, selection)
+            """)
+
+    def _object_path(self, sha256: str) -> str:
+        return os.path.join(self.path, "objects", sha256[:2], f"{sha256}.m4a")
+
+    def lookup(self, song: Song, selection: str) -> str | None:
+        """`str`|`None`: Returns path of stored file for song, `None` if the
+        song wasn't stored or its file is damaged.
+
+        Arguments
+        ---------
+        song: `Song`
+            Catalog song to look up by ID, then by ISRC.
+        selection: `str`
+            Flavor selection the file has to be downloaded with, see
+            `PlaybackAPI.flavor_selection`.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256, size FROM downloads"
+                " WHERE catalog_id = ? AND selection = ?",
+                (song.id, selection),
+            ).fetchone()
+            if row is None and song.isrc:
+                row = self._db.execute(
+                    "SELECT sha256, size FROM downloads"
+                    " WHERE isrc = ? AND selection = ?",
+                    (song.isrc, selection),
+                ).fetchone()
+        if row is None:
+            return None
+        sha256, size = row
+        path = self._object_path(sha256)
+        try:
+            intact = os.path.getsize(path) == size
+            if intact and self.verify:
+                intact = _hash_file(path) == sha256
+        except FileNotFoundError:
+            intact = False
+        if not intact:
+            _log.warning("stored file %s is damaged, dropping it", path)
+            self._drop(sha256)
+            return None
+        _log.debug("found %s in store", song.id)
+        return path
+
+    def add_file(
+        self, song: Song, selection: str, flavor: str, source: str
+    ) -> str:
+        """`str`: Stores untagged file of song, returns stored file path.
+
+        Arguments
+        ---------
+        song: `Song`
+            Catalog song the file belongs to.
+        selection: `str`
+            Flavor selection the file was downloaded with.
+        flavor: `str`
+            Downloaded flavor.
+        source: `str`
+            Path of decrypted, untagged file.
+        """
+        sha256 = _hash_file(source)
+        path = self._object_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            clone_file(source, tmp_path, hardlink=False)
+            self._seal(tmp_path, path)
+        self._index(song, selection, flavor, sha256, os.path.getsize(path))
+        return path
+
+    def add_bytes(
+        self, song: Song, selection: str, flavor: str, data: bytes
+    ) -> str:
+        """`str`: Stores untagged song data, returns stored file path.
+
+        Arguments
+        ---------
+        song: `Song`
+            Catalog song the data belongs to.
+        selection: `str`
+            Flavor selection the data was downloaded with.
+        flavor: `str`
+            Downloaded flavor.
+        data: `bytes`
+            Decrypted, untagged song data.
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self._object_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            self._seal(tmp_path, path)
+        self._index(song, selection, flavor, sha256, len(data))
+        return path
+
+    def _seal(self, tmp_path: str, path: str) -> None:
+        # Stored files are read-only, so hard-linked outputs can't be tagged
+        # or edited by accident
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(tmp_path, path)
+
+    def _index(
+        self, song: Song, selection: str, flavor: str, sha256: str, size: int
+    ) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    song.id,
+                    song.isrc,
+                    selection,
+                    flavor,
+                    sha256,
+                    size,
+                    time.time(),
+                ),
+            )
+
+    def _drop(self, sha256: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM downloads WHERE sha256 = ?", (sha256,)
+            )
+        try:
+            os.remove(self._object_path(sha256))
+        except FileNotFoundError:
+            pass
+
+
+def clone_file(source: str, target: str, hardlink: bool = False) -> None:
+    """Makes target a copy of source as cheaply as possible.
+
+    Tries a copy-on-write clone first, then a hard link if allowed, and
+    copies the file as a last resort. Existing target is replaced.
+
+    Arguments
+    ---------
+    source: `str`
+        File to copy.
+    target: `str`
+        Path of the copy.
+    hardlink: `bool`
+        Allow hard links. Hard-linked files share their contents, so the target
+        must not be modified afterwards.
+    """
+    tmp_path = f"{target}.{threading.get_ident()}.tmp"
+    if fcntl is not None:
+        try:
+            with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            os.replace(tmp_path, target)
+            return
+        except OSError:
+            # Opening source or target may have failed before tmp_path existed
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+    if hardlink:
+        try:
+            os.link(source, tmp_path)
+            os.replace(tmp_path, target)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def _hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            sha256.update(chunk)
+    return sha256.hexdigest()
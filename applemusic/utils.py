@@ -0,0 +1,35 @@
+import re
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Iterator[List[`T`]]: Splits items into lists of at most `size` elements.
+
+    Arguments
+    ---------
+    items: Iterable[`T`]
+        Items to split.
+    size: `int`
+        Maximum chunk length.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def safe_filename(name: str) -> str:
+    """`str`: Replaces characters not allowed in file names with underscores.
+
+    Arguments
+    ---------
+    name: `str`
+        File name without directory.
+    """
+    return re.sub(r'[\\/:*?"<>|]', "_", name)
@@ -0,0 +1,69 @@
+"""Micro-benchmark of mdat sample decryption on synthetic CENC fragments.
+
+Usage: python benchmarks/decrypt.py [fragments] [samples per fragment]
+"""
+
+import os
+import sys
+import time
+from io import BytesIO
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Util import Counter
+
+from applemusic.decrypt import decrypt_samples
+
+KEY = bytes(range(16))
+
+
+def make_fragment(samples, sample_size=1024):
+    """Returns encrypted mdat payload and (iv, size, subsamples) sample list."""
+    payload = bytearray()
+    info = []
+    for _ in range(samples):
+        iv = os.urandom(8)
+        cipher = AES.new(KEY, AES.MODE_CTR, nonce=iv, initial_value=0)
+        payload += cipher.encrypt(os.urandom(sample_size))
+        info.append((iv, sample_size, None))
+    return bytes(payload), info
+
+
+def legacy_decrypt_samples(key, data, samples):
+    """Sample loop as it was before decrypt_samples."""
+    clear_box = b""
+    with BytesIO(data) as box_bytes:
+        for iv, size, _ in samples:
+            counter = Counter.new(64, prefix=iv, initial_value=0)
+            cipher = AES.new(key, AES.MODE_CTR, counter=counter)
+            clear_box += cipher.decrypt(box_bytes.read(size))
+    return clear_box
+
+
+def current_decrypt_samples(key, data, samples):
+    out = bytearray(len(data))
+    decrypt_samples(key, data, out, samples)
+    return out
+
+
+def measure(func, fragments):
+    start = time.perf_counter()
+    results = [func(KEY, data, samples) for data, samples in fragments]
+    elapsed = time.perf_counter() - start
+    size = sum(len(data) for data, _ in fragments)
+    return size / elapsed / 2**20, results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    fragments = [make_fragment(samples) for _ in range(count)]
+    before, expected = measure(legacy_decrypt_samples, fragments)
+    after, actual = measure(current_decrypt_samples, fragments)
+    assert all(bytes(a) == e for a, e in zip(actual, expected))
+    print(f"{count} fragments x {samples} samples")
+    print(f"before: {before:8.1f} MB/s")
+    print(f"after:  {after:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Checks decrypt against the pymp4 based implementation it replaced.
+
+Synthetic CENC files with variable sample sizes, subsample encryption and a
+constant stsz sample size are decrypted by the legacy implementation and by
+decrypt and decrypt_file, serially and in parallel. All outputs have to be
+byte-identical.
+
+Usage: python benchmarks/decrypt_equivalence.py [fragments] [samples per fragment]
+"""
+
+import os
+import random
+import struct
+import sys
+import tempfile
+from collections import deque
+from io import BufferedReader, BytesIO
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Util import Counter
+from pymp4.parser import Box
+from pymp4.util import BoxUtil
+
+from applemusic.decrypt import decrypt, decrypt_file
+
+KEY = bytes(range(16))
+
+
+def box(box_type, payload):
+    return struct.pack(">I", len(payload) + 8) + box_type + payload
+
+
+def full_box(box_type, version, flags, payload):
+    return box(box_type, struct.pack(">I", version << 24 | flags) + payload)
+
+
+def encrypt_sample(rnd, clear, subsamples):
+    """Returns encrypted sample and its senc entry."""
+    iv = os.urandom(8)
+    cipher = AES.new(KEY, AES.MODE_CTR, nonce=iv, initial_value=0)
+    if not subsamples:
+        return cipher.encrypt(clear), iv
+    encrypted = b""
+    entries = []
+    pos = 0
+    while pos < len(clear):
+        clear_bytes = min(rnd.randint(0, 40), len(clear) - pos)
+        cipher_bytes = min(rnd.randint(0, 300), len(clear) - pos - clear_bytes)
+        if clear_bytes == cipher_bytes == 0:
+            cipher_bytes = len(clear) - pos
+        encrypted += clear[pos : pos + clear_bytes]
+        pos += clear_bytes
+        encrypted += cipher.encrypt(clear[pos : pos + cipher_bytes])
+        pos += cipher_bytes
+        entries.append(struct.pack(">HI", clear_bytes, cipher_bytes))
+    return encrypted, iv + struct.pack(">H", len(entries)) + b"".join(entries)
+
+
+def make_file(fragments, samples, subsamples=False, sample_size=0, seed=1):
+    """Returns encrypted fragmented MP4 with an encrypted audio track.
+
+    Samples vary in size if sample_size is 0, otherwise stsz carries it.
+    """
+    rnd = random.Random(seed)
+    tenc = full_box(b"tenc", 0, 0, b"\0\0\1\x08" + KEY)
+    sinf = box(
+        b"sinf",
+        box(b"frma", b"mp4a")
+        + full_box(b"schm", 0, 0, b"cenc" + struct.pack(">I", 0x10000))
+        + box(b"schi", tenc),
+    )
+    enca = box(
+        b"enca",
+        b"\0" * 6
+        + struct.pack(">H", 1)
+        + struct.pack(">HHIHHhHH", 0, 0, 0, 2, 16, 0, 0, 44100)
+        + b"\0\0"
+        + sinf,
+    )
+    stsd = full_box(b"stsd", 0, 0, struct.pack(">I", 1) + enca)
+    stsz = full_box(b"stsz", 0, 0, struct.pack(">II", sample_size, 0))
+    stbl = box(b"stbl", stsd + stsz)
+    moov = box(b"moov", box(b"trak", box(b"mdia", box(b"minf", stbl))))
+    out = box(b"ftyp", b"M4A " + struct.pack(">I", 0) + b"isom") + moov
+    for i in range(fragments):
+        sizes = [sample_size or rnd.randint(200, 800) for _ in range(samples)]
+        encrypted = [
+            encrypt_sample(rnd, os.urandom(size), subsamples) for size in sizes
+        ]
+        tfhd = full_box(b"tfhd", 0, 0x20000, struct.pack(">I", 1))
+        trun = full_box(
+            b"trun",
+            0,
+            0x1 if sample_size else 0x201,
+            struct.pack(">Ii", samples, 0)
+            + b"".join(
+                struct.pack(">I", size) for size in sizes if not sample_size
+            ),
+        )
+        senc = full_box(
+            b"senc",
+            0,
+            2 if subsamples else 0,
+            struct.pack(">I", samples) + b"".join(e for _, e in encrypted),
+        )
+        moof = box(
+            b"moof",
+            full_box(b"mfhd", 0, 0, struct.pack(">I", i + 1))
+            + box(b"traf", tfhd + trun + senc),
+        )
+        out += moof + box(b"mdat", b"".join(s for s, _ in encrypted))
+    return out
+
+
+def legacy_decrypt(key, inp, out):
+    """decrypt as it was before the box walker, parsing boxes with pymp4."""
+    with BufferedReader(inp) as reader:
+        senc_boxes = deque()
+        trun_boxes = deque()
+        boxes = []
+        sample_size = 0
+        while reader.peek(1):
+            box = Box.parse_stream(reader)
+            for stsd_box in BoxUtil.find(box, b"stsd"):
+                for entry in stsd_box.entries:
+                    if b"enc" in entry.format:
+                        entry.format = b"mp4a"
+            for stsz_box in BoxUtil.find(box, b"stsz"):
+                sample_size = stsz_box.sample_size
+            for stsd_box in BoxUtil.find(box, b"stsd"):
+                entry = stsd_box.entries[0]
+                for child in entry.children:
+                    if child.type == b"sinf":
+                        entry.children.remove(child)
+            if box.type == b"moof":
+                senc_boxes.extend(BoxUtil.find(box, b"senc"))
+                trun_boxes.extend(BoxUtil.find(box, b"trun"))
+            elif box.type == b"mdat":
+                senc_box = senc_boxes.popleft()
+                trun_box = trun_boxes.popleft()
+                clear_box = b""
+                with BytesIO(box.data) as box_bytes:
+                    for sample, sample_info in zip(
+                        senc_box.sample_encryption_info, trun_box.sample_info
+                    ):
+                        counter = Counter.new(
+                            64, prefix=sample.iv, initial_value=0
+                        )
+                        cipher = AES.new(key, AES.MODE_CTR, counter=counter)
+                        if sample_size:
+                            clear_box += cipher.decrypt(
+                                box_bytes.read(sample_size)
+                            )
+                        elif not sample.subsample_encryption_info:
+                            clear_box += cipher.decrypt(
+                                box_bytes.read(sample_info.sample_size)
+                            )
+                        else:
+                            for subsample in sample.subsample_encryption_info:
+                                clear_box += box_bytes.read(
+                                    subsample.clear_bytes
+                                )
+                                clear_box += cipher.decrypt(
+                                    box_bytes.read(subsample.cipher_bytes)
+                                )
+                box.data = clear_box
+            boxes.append(box)
+    for b in boxes:
+        out.write(Box.build(b))
+
+
+def decrypt_bytes(data, workers):
+    out = BytesIO()
+    decrypt(KEY, BytesIO(data), out, workers)
+    return out.getvalue()
+
+
+def decrypt_path(data, workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        in_path = os.path.join(tmp, "in.m4a")
+        out_path = os.path.join(tmp, "out.m4a")
+        with open(in_path, "wb") as f:
+            f.write(data)
+        decrypt_file(KEY, in_path, out_path, workers)
+        with open(out_path, "rb") as f:
+            return f.read()
+
+
+def main():
+    fragments = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    cases = {
+        "variable size": make_file(fragments, samples),
+        "subsamples": make_file(fragments, samples, subsamples=True),
+        "constant stsz": make_file(fragments, samples, sample_size=512),
+    }
+    failed = False
+    for name, data in cases.items():
+        expected = BytesIO()
+        legacy_decrypt(KEY, BytesIO(data), expected)
+        for func in (decrypt_bytes, decrypt_path):
+            for workers in (0, 4):
+                equal = func(data, workers) == expected.getvalue()
+                failed |= not equal
+                print(
+                    f"{name:14} {func.__name__:13} workers={workers}:"
+                    f" {'ok' if equal else 'MISMATCH'}"
+                )
+    sys.exit(failed)
+
+
+if __name__ == "__main__":
+    main()